@@ -3,17 +3,27 @@ API Server per Demo - Versione Corretta e Funzionante
 Fixes per il problema delle decisioni AI pending
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, has_request_context, stream_with_context
 from flask_cors import CORS
 import asyncio
+import concurrent.futures
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from asyncua import Client
+from psycopg2.extensions import STATUS_READY
+from psycopg2.pool import PoolError
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import queue
+import select
+import socket
+import threading
+import time
+from asyncua import Client, ua
 import json
 import os
 import logging
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Callable, Dict, Optional, Tuple
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,6 +31,656 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
+class RefineryTagCache:
+    """Cache browse name -> NodeId delle variabili del nodo Refinery
+
+    La risoluzione (browse completo) avviene una volta per sessione; su una nuova
+    sessione basta una lettura di NamespaceArray e StartTime del server per
+    confermare che l'address space non è cambiato.
+    """
+
+    def __init__(self, object_name: str = 'Refinery'):
+        self.object_name = object_name
+        self.node_ids: Dict[str, ua.NodeId] = {}
+        self.resolve_count = 0
+        self._fingerprint = None
+        self._session_key = None
+
+    async def resolve(self, client: Client, session_key=None) -> Dict[str, ua.NodeId]:
+        """Restituisce la mappa browse name -> NodeId, risolvendola solo se necessario"""
+        if self.node_ids and session_key is not None and session_key == self._session_key:
+            return self.node_ids
+
+        fingerprint = await self._read_fingerprint(client)
+        if not self.node_ids or fingerprint != self._fingerprint:
+            self.node_ids = await self._browse(client)
+            self._fingerprint = fingerprint
+            self.resolve_count += 1
+            logger.info(f"🗂️ Resolved {len(self.node_ids)} {self.object_name} tags")
+
+        self._session_key = session_key
+        return self.node_ids
+
+    def invalidate(self) -> None:
+        """Forza un nuovo browse alla prossima risoluzione (es. BadNodeIdUnknown)"""
+        self.node_ids = {}
+        self._fingerprint = None
+        self._session_key = None
+
+    async def _read_fingerprint(self, client: Client) -> Tuple:
+        namespace_array, start_time = await client.read_values([
+            client.get_node(ua.ObjectIds.Server_NamespaceArray),
+            client.get_node(ua.ObjectIds.Server_ServerStatus_StartTime)
+        ])
+        return tuple(namespace_array or ()), start_time
+
+    async def _browse(self, client: Client) -> Dict[str, ua.NodeId]:
+        root = client.get_root_node()
+        objects = await root.get_child(["0:Objects"])
+        children = await objects.get_children()
+
+        refinery_node = None
+        for child in children:
+            display_name = await child.read_display_name()
+            if display_name.Text == self.object_name:
+                refinery_node = child
+                break
+
+        if not refinery_node:
+            return {}
+
+        node_ids = {}
+        for var in await refinery_node.get_children():
+            browse_name = await var.read_browse_name()
+            node_ids[str(browse_name.Name)] = var.nodeid
+        return node_ids
+
+
+class ConnectionPool:
+    """Pool di connessioni psycopg2 limitato e thread-safe
+
+    - al massimo max_size connessioni aperte; oltre, le richieste attendono fino
+      ad acquire_timeout secondi e poi falliscono con PoolError
+    - health check (SELECT 1) sulle connessioni rimaste inattive più di idle_check_after
+    - riciclo delle connessioni più vecchie di max_lifetime secondi
+    - metriche globali e per endpoint Flask (checkout, attese, timeout)
+    - statement preparati (PREPARE) all'apertura di ogni connessione, eseguiti con
+      execute_prepared e cronometrati per nome
+    """
+
+    def __init__(self, db_config: Dict, max_size: int = 10, acquire_timeout: float = 5.0,
+                 max_lifetime: float = 1800.0, idle_check_after: float = 30.0,
+                 statements: Optional[Dict[str, str]] = None):
+        self.db_config = db_config
+        self.statements = statements or {}
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.idle_check_after = idle_check_after
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle = deque()  # (conn, created_at, last_used)
+        self._created_at = {}
+        self.metrics = {
+            'in_use': 0, 'opened': 0, 'closed': 0, 'recycled': 0,
+            'health_check_failures': 0, 'checkouts': 0, 'waits': 0, 'timeouts': 0,
+            'wait_ms_total': 0.0
+        }
+        self.endpoint_metrics = defaultdict(lambda: {'checkouts': 0, 'waits': 0, 'timeouts': 0})
+        self.query_metrics = defaultdict(lambda: {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+
+    @contextmanager
+    def connection(self):
+        """Presta una connessione; al rilascio eventuali transazioni aperte vengono annullate"""
+        endpoint = request.endpoint if has_request_context() else 'background'
+        self._acquire_slot(endpoint)
+
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.metrics['in_use'] += 1
+            self.metrics['checkouts'] += 1
+            self.endpoint_metrics[endpoint]['checkouts'] += 1
+
+        try:
+            yield conn
+        finally:
+            self._checkin(conn)
+            with self._lock:
+                self.metrics['in_use'] -= 1
+            self._slots.release()
+
+    def _acquire_slot(self, endpoint: str) -> None:
+        if self._slots.acquire(blocking=False):
+            return
+
+        start = time.perf_counter()
+        with self._lock:
+            self.metrics['waits'] += 1
+            self.endpoint_metrics[endpoint]['waits'] += 1
+
+        acquired = self._slots.acquire(timeout=self.acquire_timeout)
+        with self._lock:
+            self.metrics['wait_ms_total'] += (time.perf_counter() - start) * 1000
+            if not acquired:
+                self.metrics['timeouts'] += 1
+                self.endpoint_metrics[endpoint]['timeouts'] += 1
+
+        if not acquired:
+            raise PoolError(f"No database connection available within {self.acquire_timeout}s")
+
+    def _checkout(self):
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                entry = self._idle.popleft() if self._idle else None
+            if entry is None:
+                return self._open()
+
+            conn, created_at, last_used = entry
+            if conn.closed or now - created_at > self.max_lifetime:
+                with self._lock:
+                    self.metrics['recycled'] += 1
+                self._close(conn)
+                continue
+
+            if now - last_used > self.idle_check_after:
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    conn.rollback()
+                except Exception as e:
+                    logger.warning(f"⚠️ Pooled connection failed health check: {e}")
+                    with self._lock:
+                        self.metrics['health_check_failures'] += 1
+                    self._close(conn)
+                    continue
+
+            return conn
+
+    def _checkin(self, conn) -> None:
+        if not conn.closed:
+            try:
+                if conn.status != STATUS_READY:
+                    conn.rollback()
+            except Exception:
+                self._close(conn)
+                return
+
+        if conn.closed:
+            self._close(conn)
+            return
+
+        with self._lock:
+            self._idle.append((conn, self._created_at[id(conn)], time.monotonic()))
+
+    def _open(self):
+        conn = psycopg2.connect(**self.db_config)
+        if self.statements:
+            # I prepared statement vivono quanto la sessione: pianificati una volta per connessione
+            try:
+                with conn.cursor() as cursor:
+                    for name, query in self.statements.items():
+                        cursor.execute(f"PREPARE {name} AS {query}")
+                conn.commit()
+            except Exception:
+                conn.close()
+                raise
+        with self._lock:
+            self._created_at[id(conn)] = time.monotonic()
+            self.metrics['opened'] += 1
+        return conn
+
+    def _close(self, conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created_at.pop(id(conn), None)
+            self.metrics['closed'] += 1
+
+    def execute_prepared(self, cursor, name: str, params: Tuple = ()) -> None:
+        """Esegue uno statement preparato (EXECUTE) registrandone la latenza per nome"""
+        placeholders = f" ({', '.join(['%s'] * len(params))})" if params else ""
+        start = time.perf_counter()
+        failed = False
+        try:
+            cursor.execute(f"EXECUTE {name}{placeholders}", params)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                stats = self.query_metrics[name]
+                stats['count'] += 1
+                stats['errors'] += failed
+                stats['total_ms'] += elapsed_ms
+                stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+    def snapshot(self) -> Dict:
+        """Metriche correnti del pool (esportate da /api/pool/metrics e /api/status)"""
+        with self._lock:
+            return {
+                **self.metrics,
+                'idle': len(self._idle),
+                'open': len(self._created_at),
+                'max_size': self.max_size,
+                'by_endpoint': {name: dict(values) for name, values in self.endpoint_metrics.items()},
+                'queries': {
+                    name: {
+                        'count': values['count'],
+                        'errors': values['errors'],
+                        'avg_ms': round(values['total_ms'] / values['count'], 3) if values['count'] else 0.0,
+                        'max_ms': round(values['max_ms'], 3)
+                    }
+                    for name, values in self.query_metrics.items()
+                }
+            }
+
+
+class OPCSession:
+    """Sessione OPC-UA persistente con supervisore di riconnessione e backoff esponenziale"""
+
+    def __init__(self, url: str, session_timeout: int = 10000, keepalive_interval: float = 5.0,
+                 backoff_initial: float = 1.0, backoff_max: float = 30.0):
+        self.url = url
+        self.session_timeout = session_timeout
+        self.keepalive_interval = keepalive_interval
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.client: Optional[Client] = None
+        self.connected = False
+        self.reconnect_count = 0
+        self.generation = 0  # Incrementato ad ogni nuova sessione stabilita
+        self._backoff = backoff_initial
+        self._next_attempt = 0.0
+        self._lock = asyncio.Lock()
+        self._supervisor_task: Optional[asyncio.Task] = None
+
+    async def ensure_connected(self) -> Client:
+        """Restituisce il client connesso, riconnettendo se necessario (rispettando il backoff)"""
+        if self.connected:
+            return self.client
+
+        async with self._lock:
+            if self.connected:
+                return self.client
+
+            wait = self._next_attempt - time.monotonic()
+            if wait > 0:
+                raise ConnectionError(f"OPC-UA reconnect in backoff ({wait:.1f}s remaining)")
+
+            client = Client(self.url)
+            client.session_timeout = self.session_timeout
+            try:
+                await client.connect()
+            except Exception:
+                self._next_attempt = time.monotonic() + self._backoff
+                self._backoff = min(self.backoff_max, self._backoff * 2)
+                raise
+
+            self.client = client
+            self.connected = True
+            self._backoff = self.backoff_initial
+            self._next_attempt = 0.0
+
+            if self.generation > 0:
+                self.reconnect_count += 1
+                logger.info(f"🔁 OPC-UA session re-established (reconnects: {self.reconnect_count})")
+            else:
+                logger.info(f"🔗 OPC-UA session established with {self.url}")
+            self.generation += 1
+
+            return self.client
+
+    async def invalidate(self, reason) -> None:
+        """Marca la sessione come caduta: la prossima lettura o il supervisore riconnettono"""
+        if not self.connected:
+            return
+
+        self.connected = False
+        client, self.client = self.client, None
+        logger.warning(f"⚠️ OPC-UA session lost: {reason}")
+
+        try:
+            await asyncio.wait_for(client.disconnect(), timeout=2)
+        except Exception:
+            pass
+
+    def start(self) -> None:
+        """Avvia il supervisore (keep-alive + riconnessione) in background"""
+        if self._supervisor_task is None:
+            self._supervisor_task = asyncio.create_task(self._supervise())
+
+    async def _supervise(self):
+        """Verifica periodicamente lo stato del server e riconnette in caso di caduta"""
+        while True:
+            if self.connected:
+                try:
+                    state_node = self.client.get_node(ua.ObjectIds.Server_ServerStatus_State)
+                    await asyncio.wait_for(state_node.read_value(), timeout=self.keepalive_interval)
+                except Exception as e:
+                    await self.invalidate(e)
+
+            if not self.connected:
+                try:
+                    await self.ensure_connected()
+                except Exception as e:
+                    logger.debug(f"⚠️ OPC-UA reconnect attempt failed: {e}")
+
+            await asyncio.sleep(self.keepalive_interval)
+
+    async def close(self) -> None:
+        """Ferma il supervisore e chiude la sessione"""
+        if self._supervisor_task:
+            self._supervisor_task.cancel()
+            try:
+                await self._supervisor_task
+            except asyncio.CancelledError:
+                pass
+            self._supervisor_task = None
+
+        if self.connected:
+            self.connected = False
+            try:
+                await asyncio.wait_for(self.client.disconnect(), timeout=2)
+            except Exception:
+                pass
+            self.client = None
+
+
+class OPCWriter:
+    """Event loop asyncio in un thread dedicato, proprietario della sessione OPC-UA dell'API
+
+    Gli handler Flask inviano le scritture con submit() e attendono il risultato con
+    timeout; le scritture vengono serializzate sul loop (una alla volta).
+    """
+
+    def __init__(self, applier: 'AIDecisionApplier', timeout: float = 10.0):
+        self.applier = applier
+        self.timeout = timeout
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._write_lock: Optional[asyncio.Lock] = None
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run, name='opc-writer', daemon=True)
+            self._thread.start()
+            asyncio.run_coroutine_threadsafe(self._start_session(), self.loop).result(timeout=self.timeout)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _start_session(self):
+        self._write_lock = asyncio.Lock()
+        self.applier.opc_session.start()
+
+    async def _serialized_apply(self, parameters: Dict) -> Dict:
+        async with self._write_lock:
+            return await self.applier.apply_ai_parameters(parameters)
+
+    def apply(self, parameters: Dict) -> Dict:
+        """Applica i parametri sulla sessione persistente, attendendo al massimo timeout secondi"""
+        self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(self._serialized_apply(parameters), self.loop)
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            logger.error(f"❌ OPC-UA write timed out after {self.timeout}s")
+            return {'success': False, 'tag_status': {}, 'error': 'timeout'}
+
+
+class LiveBroadcaster:
+    """Fan-out Server-Sent Events dello stato live (processo + decisione pendente)
+
+    Un solo thread legge lo stato dal database una volta per tick e distribuisce a
+    tutti i client connessi solo i campi cambiati (delta); i nuovi client ricevono
+    prima uno snapshot completo. Senza client connessi non viene eseguita alcuna query.
+    """
+
+    def __init__(self, fetch_state: Callable[[], Dict], interval: float = 2.0, max_queue: int = 50):
+        self.fetch_state = fetch_state
+        self.interval = interval
+        self.max_queue = max_queue
+        self.state: Dict = {}
+        self.version = 0
+        self.ticks = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+
+    def wake(self) -> None:
+        """Anticipa il prossimo tick (nuovi dati notificati dal database)"""
+        self._wake.set()
+
+    def subscribe(self) -> queue.Queue:
+        subscriber = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self.state:
+                subscriber.put_nowait(('snapshot', {'version': self.version, 'state': self.state}))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-broadcaster', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue) -> None:
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @property
+    def client_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def _run(self):
+        while True:
+            if self.client_count:
+                try:
+                    self._tick()
+                except Exception as e:
+                    logger.error(f"Error refreshing live stream state: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _tick(self):
+        new_state = self.fetch_state()
+        self.ticks += 1
+        changes = self._diff(self.state, new_state)
+        if not changes:
+            return
+
+        with self._lock:
+            self.state = new_state
+            self.version += 1
+            delta = ('delta', {'version': self.version, 'changes': changes})
+            for subscriber in self._subscribers:
+                # Un client in errore non deve interrompere la consegna agli altri
+                try:
+                    self._publish(subscriber, delta)
+                except Exception as e:
+                    logger.error(f"Error publishing live update to a stream client: {e}")
+
+    def _publish(self, subscriber: queue.Queue, event) -> None:
+        try:
+            subscriber.put_nowait(event)
+        except queue.Full:
+            # Client troppo lento: scarta gli eventi arretrati e risincronizza con uno snapshot.
+            # Il generatore SSE svuota la coda senza lock: può vuotarla tra empty() e get_nowait()
+            try:
+                while True:
+                    subscriber.get_nowait()
+            except queue.Empty:
+                pass
+            subscriber.put_nowait(('snapshot', {'version': self.version, 'state': self.state}))
+
+    @staticmethod
+    def _diff(old: Dict, new: Dict) -> Dict:
+        """Delta per sezione: solo i campi modificati, sezione intera se compare/scompare"""
+        changes = {}
+        for section, values in new.items():
+            previous = old.get(section)
+            if not isinstance(values, dict) or not isinstance(previous, dict):
+                if values != previous:
+                    changes[section] = values
+                continue
+            delta = {key: value for key, value in values.items() if previous.get(key) != value}
+            delta.update({key: None for key in previous.keys() - values.keys()})
+            if delta:
+                changes[section] = delta
+        return changes
+
+
+# Query calde: preparate su ogni connessione del pool ed eseguite per nome
+PREPARED_STATEMENTS = {
+    'latest_ai_decision': """
+        SELECT id, timestamp, parameters_changed, predicted_bit_tq, predicted_energy_saving,
+               predicted_co2_reduction, confidence, savings_eur_hour, decision_applied, decision_type
+        FROM ai_decisions
+        WHERE state = 'pending'
+        AND unit_id = $1
+        ORDER BY timestamp DESC
+        LIMIT 1
+    """,
+    'claim_decision': """
+        UPDATE ai_decisions d
+        SET state = 'claimed', claimed_at = NOW(), claimed_by = $2
+        FROM (
+            SELECT id, timestamp
+            FROM ai_decisions
+            WHERE unit_id = $1
+            AND (state = 'pending'
+                 OR (state = 'claimed' AND claimed_at < NOW() - make_interval(secs => $3)))
+            ORDER BY timestamp DESC
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        ) candidate
+        WHERE d.id = candidate.id AND d.timestamp = candidate.timestamp
+        RETURNING d.id, d.timestamp, d.parameters_changed, d.predicted_bit_tq,
+                  d.predicted_energy_saving, d.predicted_co2_reduction, d.confidence,
+                  d.savings_eur_hour, d.decision_type, d.claimed_at
+    """,
+    'finalize_decision': """
+        UPDATE ai_decisions
+        SET state = $1,
+            decision_applied = ($1 = 'applied'),
+            operator_approved = CASE WHEN $1 = 'applied' THEN true ELSE operator_approved END,
+            applied_at = CASE WHEN $1 = 'applied' THEN NOW() END,
+            apply_error = $2
+        WHERE id = $3 AND timestamp = $4
+        AND state = 'claimed' AND claimed_by = $5 AND claimed_at = $6
+    """,
+    'current_process_data': """
+        SELECT bit_tq, energy_consumption, co2_emissions, process_efficiency, data_source,
+               timestamp, fc1065, li40054, fc31007, pi18213, unit_id, updated_at,
+               EXTRACT(EPOCH FROM NOW() - timestamp) AS age_seconds
+        FROM process_latest
+        WHERE unit_id = $1
+    """,
+    'live_state': """
+        SELECT
+            (SELECT row_to_json(p) FROM (
+                SELECT timestamp, bit_tq, energy_consumption, co2_emissions,
+                       process_efficiency, data_source, fc1065, li40054, fc31007, pi18213,
+                       data_source = 'ai_control' AS is_ai_control
+                FROM process_latest
+                WHERE unit_id = $1
+            ) p) AS process,
+            (SELECT row_to_json(d) FROM (
+                SELECT id, timestamp, decision_type, confidence, predicted_bit_tq,
+                       predicted_energy_saving, predicted_co2_reduction,
+                       savings_eur_hour, parameters_changed
+                FROM ai_decisions
+                WHERE state = 'pending'
+                AND unit_id = $1
+                ORDER BY timestamp DESC
+                LIMIT 1
+            ) d) AS decision
+    """
+}
+
+
+class NotificationListener:
+    """Thread LISTEN sui canali di notifica del database (ai_decisions, process_data)
+
+    Usa una connessione dedicata in autocommit, fuori dal pool. on_state(True/False)
+    segnala connessione e disconnessione: mentre non è connesso le cache che
+    dipendono dalle notifiche devono essere ignorate, perché eventi persi non
+    verrebbero recuperati.
+    """
+
+    def __init__(self, db_config: Dict, channels: Tuple[str, ...],
+                 on_notify: Callable[[str, Dict], None], on_state: Callable[[bool], None],
+                 reconnect_interval: float = 5.0):
+        self.db_config = db_config
+        self.channels = channels
+        self.on_notify = on_notify
+        self.on_state = on_state
+        self.reconnect_interval = reconnect_interval
+        self.connected = False
+        self.notifications = 0
+        self.reconnects = 0
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-listener', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.db_config)
+                conn.autocommit = True
+                cursor = conn.cursor()
+                for channel in self.channels:
+                    cursor.execute(f"LISTEN {channel}")
+                self.connected = True
+                self.on_state(True)
+                logger.info(f"👂 Listening on {', '.join(self.channels)}")
+                
+                while True:
+                    if not select.select([conn], [], [], self.reconnect_interval)[0]:
+                        # Nessun evento: ping per rilevare connessioni cadute; le notifiche
+                        # arrivate durante il ping finiscono in conn.notifies e vanno gestite subito
+                        cursor.execute("SELECT 1")
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.notifications += 1
+                        try:
+                            self.on_notify(notify.channel, json.loads(notify.payload))
+                        except Exception as e:
+                            logger.error(f"Error handling {notify.channel} notification: {e}")
+            except Exception as e:
+                logger.warning(f"⚠️ Notification listener disconnected: {e}")
+            finally:
+                if self.connected:
+                    self.connected = False
+                    self.on_state(False)
+                if conn is not None:
+                    conn.close()
+            self.reconnects += 1
+            time.sleep(self.reconnect_interval)
+
+
 class AIDecisionApplier:
     def __init__(self):
         self.opc_url = f"opc.tcp://{os.getenv('OPC_HOST', 'localhost')}:4840/refinery"
@@ -31,41 +691,69 @@ class AIDecisionApplier:
             'password': os.getenv('DB_PASSWORD', 'password'),
             'port': 5432
         }
+        self.db_pool = ConnectionPool(
+            self.db_config,
+            max_size=int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+            acquire_timeout=float(os.getenv('DB_POOL_TIMEOUT', '5')),
+            max_lifetime=float(os.getenv('DB_POOL_MAX_LIFETIME', '1800')),
+            statements=PREPARED_STATEMENTS
+        )
+        self.opc_session = OPCSession(
+            self.opc_url,
+            keepalive_interval=float(os.getenv('OPC_KEEPALIVE_INTERVAL', '5')),
+            backoff_max=float(os.getenv('OPC_RECONNECT_BACKOFF_MAX', '30'))
+        )
+        self.tag_cache = RefineryTagCache()
+        # Unità servita dall'API (lettura da process_latest, scrittura sul server OPC_HOST)
+        self.unit_id = os.getenv('API_UNIT_ID', 'unit-1')
+        self.stale_after = float(os.getenv('PROCESS_STALE_SECONDS', '120'))
+        # Identità del worker per i claim; claim più vecchi di claim_timeout tornano disponibili
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.claim_timeout = float(os.getenv('DECISION_CLAIM_TIMEOUT', '60'))
+        self.status_cache_ttl = float(os.getenv('STATUS_CACHE_TTL', '5'))
+        # Finestra decisionale del collector: le decisioni pendenti più vecchie non contano più
+        self.pending_window = float(os.getenv('DECISION_PENDING_WINDOW', '600'))
+        self._status_cache = None
+        self._status_lock = threading.Lock()
+        # Cache della decisione pendente, valida solo con il listener connesso;
+        # ogni notifica ai_decisions incrementa la generazione e la invalida
+        self.notifications_live = False
+        self._decision_cache: Optional[Tuple[int, Optional[Dict]]] = None
+        self._decision_generation = 0
+        self._decision_lock = threading.Lock()
+    
+    def invalidate_decisions(self) -> None:
+        """Scarta la decisione in cache e il riepilogo di stato (notifica ai_decisions)"""
+        with self._decision_lock:
+            self._decision_generation += 1
+            self._decision_cache = None
+        self._status_cache = None
+    
+    def set_notifications_live(self, live: bool) -> None:
+        self.notifications_live = live
+        self.invalidate_decisions()
     
     def get_latest_ai_decision(self) -> Optional[Dict]:
         """Recupera ultima decisione AI - VERSIONE CORRETTA E FUNZIONANTE"""
+        with self._decision_lock:
+            generation = self._decision_generation
+            cached = self._decision_cache
+        if self.notifications_live and cached and cached[0] == generation:
+            return cached[1]
+        
         try:
-            conn = psycopg2.connect(**self.db_config)
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
-            # Query semplificata che funziona sempre
-            cursor.execute("""
-                SELECT 
-                    id,
-                    timestamp,
-                    parameters_changed, 
-                    predicted_bit_tq,
-                    predicted_energy_saving,
-                    predicted_co2_reduction,
-                    confidence,
-                    savings_eur_hour,
-                    decision_applied,
-                    decision_type
-                FROM ai_decisions 
-                WHERE decision_applied = false
-                ORDER BY timestamp DESC 
-                LIMIT 1
-            """)
-            
-            result = cursor.fetchone()
-            conn.close()
+            with self.db_pool.connection() as conn:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                self.db_pool.execute_prepared(cursor, 'latest_ai_decision', (self.unit_id,))
+                result = cursor.fetchone()
             
+            decision = None
             if result:
                 logger.info(f"✅ Found AI decision ID={result['id']}, timestamp={result['timestamp']}")
-                return {
-                    'id': result['id'] or int(result['timestamp'].timestamp()),
+                decision = {
+                    'id': result['id'],
                     'timestamp': result['timestamp'],
-                    'parameters_changed': json.loads(result['parameters_changed']) if result['parameters_changed'] else {},
+                    'parameters_changed': result['parameters_changed'] or {},  # JSONB già decodificato da psycopg2
                     'predicted_bit_tq': result['predicted_bit_tq'],
                     'predicted_energy_saving': result['predicted_energy_saving'],
                     'predicted_co2_reduction': result['predicted_co2_reduction'],
@@ -76,145 +764,256 @@ class AIDecisionApplier:
                 }
             else:
                 logger.info("No pending AI decisions found")
-                return None
+            
+            # Non salva se nel frattempo è arrivata una notifica (risultato forse già vecchio)
+            with self._decision_lock:
+                if self._decision_generation == generation:
+                    self._decision_cache = (generation, decision)
+            return decision
             
         except Exception as e:
             logger.error(f"Error getting latest AI decision: {e}")
             return None
     
     def get_current_process_data(self) -> Optional[Dict]:
-        """Recupera i dati attuali del processo dal database"""
+        """Recupera i dati attuali del processo da process_latest (lookup per chiave primaria)"""
         try:
-            conn = psycopg2.connect(**self.db_config)
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
-            cursor.execute("""
-                SELECT 
-                    bit_tq,
-                    energy_consumption,
-                    co2_emissions,
-                    process_efficiency,
-                    data_source,
-                    timestamp,
-                    fc1065,
-                    li40054,
-                    fc31007,
-                    pi18213
-                FROM process_data 
-                ORDER BY timestamp DESC 
-                LIMIT 1
-            """)
-            
-            result = cursor.fetchone()
-            conn.close()
+            with self.db_pool.connection() as conn:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                self.db_pool.execute_prepared(cursor, 'current_process_data', (self.unit_id,))
+                result = cursor.fetchone()
             
             if result:
-                return dict(result)
+                data = dict(result)
+                data['age_seconds'] = float(data['age_seconds'])
+                data['stale'] = data['age_seconds'] > self.stale_after
+                return data
             return None
             
         except Exception as e:
             logger.error(f"Error getting current process data: {e}")
             return None
     
-    async def apply_ai_parameters(self, parameters: Dict) -> bool:
-        """Applica i parametri AI al server OPC-UA - VERSIONE ROBUSTA"""
+    async def apply_ai_parameters(self, parameters: Dict) -> Dict:
+        """Applica i parametri AI al server OPC-UA con una singola richiesta Write
+
+        Usa la sessione persistente: va eseguita sul loop di OPCWriter.
+        Restituisce {'success': bool, 'tag_status': {nome: status code}}.
+        """
+        tag_status = {}
         try:
-            client = Client(self.opc_url)
-            client.set_session_timeout(10000)
-            client.set_security_string("None")
+            client = await self.opc_session.ensure_connected()
             
-            await client.connect()
-            logger.info("🔗 Connected to OPC-UA server for parameter application")
+            # Risolve i NodeId dalla cache (browse solo se l'address space è cambiato)
+            node_ids = await self.tag_cache.resolve(client, self.opc_session.generation)
             
-            # Trova il nodo della raffineria
-            root = client.get_root_node()
-            objects = await root.get_child(["0:Objects"])
-            children = await objects.get_children()
+            if not node_ids:
+                logger.error("❌ Refinery node not found")
+                return {'success': False, 'tag_status': tag_status}
             
-            refinery_node = None
-            for child in children:
-                display_name = await child.read_display_name()
-                if "Refinery" in str(display_name):
-                    refinery_node = child
-                    break
+            # Prepara tutte le scritture, modalità operatore inclusa (AI salvo diversa indicazione)
+            writes = {}
+            for var_name, value in parameters.items():
+                if var_name not in node_ids:
+                    tag_status[var_name] = 'BadNodeIdUnknown'
+                    continue
+                try:
+                    writes[var_name] = float(value)
+                except (TypeError, ValueError):
+                    tag_status[var_name] = 'BadTypeMismatch'
             
-            if not refinery_node:
-                logger.error("❌ Refinery node not found")
-                await client.disconnect()
-                return False
+            if 'operator_mode' in node_ids:
+                writes.setdefault('operator_mode', 1.0)
             
-            # Applica i parametri
-            variables = await refinery_node.get_children()
-            applied_count = 0
+            # Una sola richiesta Write per tutti i nodi
+            var_names = list(writes)
+            results = await client.write_values(
+                [client.get_node(node_ids[name]) for name in var_names],
+                [writes[name] for name in var_names],
+                raise_on_partial_error=False
+            )
             
-            for var in variables:
-                browse_name = await var.read_browse_name()
-                var_name = str(browse_name.Name)
-                
-                if var_name in parameters:
-                    try:
-                        new_value = float(parameters[var_name])
-                        await var.write_value(new_value)
-                        logger.info(f"✅ Applied {var_name}: {new_value}")
+            applied_count = 0
+            for var_name, status in zip(var_names, results):
+                tag_status[var_name] = status.name
+                if status.is_good():
+                    if var_name != 'operator_mode':
                         applied_count += 1
-                    except Exception as e:
-                        logger.error(f"❌ Failed to apply {var_name}: {e}")
+                    logger.info(f"✅ Applied {var_name}: {writes[var_name]}")
+                else:
+                    if status.value == ua.StatusCodes.BadNodeIdUnknown:
+                        self.tag_cache.invalidate()
+                    logger.error(f"❌ Failed to apply {var_name}: {status.name}")
             
-            # Imposta modalità AI attiva
-            for var in variables:
-                browse_name = await var.read_browse_name()
-                var_name = str(browse_name.Name)
-                if var_name == 'operator_mode':
-                    await var.write_value(1.0)  # AI control
-                    logger.info("🤖 AI control mode activated")
-                    break
+            if writes.get('operator_mode') == 1.0 and tag_status.get('operator_mode') == 'Good':
+                logger.info("🤖 AI control mode activated")
             
-            await client.disconnect()
             logger.info(f"✅ Successfully applied {applied_count} parameters")
-            return applied_count > 0
+            return {'success': applied_count > 0, 'tag_status': tag_status}
             
         except Exception as e:
             logger.error(f"❌ Error applying AI parameters: {e}")
-            return False
+            await self.opc_session.invalidate(e)
+            return {'success': False, 'tag_status': tag_status}
     
-    def mark_decision_as_applied(self, decision_id, decision_timestamp):
-        """Marca la decisione come applicata - VERSIONE ROBUSTA"""
-        try:
-            conn = psycopg2.connect(**self.db_config)
-            cursor = conn.cursor()
+    def get_status_summary(self) -> Dict:
+        """Riepilogo per /api/status con un'unica query, messo in cache per status_cache_ttl secondi
+
+        I totali usano approximate_row_count (statistiche dei chunk, costo indipendente
+        dal volume dati); il conteggio delle decisioni pendenti è esatto ma limitato
+        all'unità e alla finestra decisionale, così resta sull'indice parziale
+        idx_ai_decisions_claimable anche con righe pendenti abbandonate.
+        """
+        with self._status_lock:
+            cached = self._status_cache
+            if cached and time.monotonic() - cached[0] < self.status_cache_ttl:
+                summary = dict(cached[1])
+                summary['freshness'] = {**summary['freshness'], 'cache_age_seconds': round(time.monotonic() - cached[0], 3)}
+                return summary
             
-            # Prova prima con ID se disponibile e valido
-            if decision_id and str(decision_id).isdigit():
+            with self.db_pool.connection() as conn:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
                 cursor.execute("""
-                    UPDATE ai_decisions 
-                    SET decision_applied = true, operator_approved = true
-                    WHERE id = %s
-                """, (decision_id,))
-            else:
-                # Fallback con timestamp
-                cursor.execute("""
-                    UPDATE ai_decisions 
-                    SET decision_applied = true, operator_approved = true
-                    WHERE timestamp = %s
-                """, (decision_timestamp,))
+                    WITH analyzed AS (
+                        SELECT c.hypertable_name,
+                               MAX(GREATEST(s.last_analyze, s.last_autoanalyze)) AS analyzed_at
+                        FROM timescaledb_information.chunks c
+                        JOIN pg_stat_user_tables s
+                          ON s.schemaname = c.chunk_schema AND s.relname = c.chunk_name
+                        WHERE c.hypertable_name IN ('process_data', 'ai_decisions')
+                        GROUP BY c.hypertable_name
+                    )
+                    SELECT
+                        approximate_row_count('process_data') AS total_data_points,
+                        approximate_row_count('ai_decisions') AS total_ai_decisions,
+                        (SELECT COUNT(*) FROM ai_decisions
+                         WHERE unit_id = %s AND state = 'pending'
+                         AND timestamp > NOW() - make_interval(secs => %s)) AS pending_ai_decisions,
+                        (SELECT analyzed_at FROM analyzed WHERE hypertable_name = 'process_data') AS process_data_analyzed_at,
+                        (SELECT analyzed_at FROM analyzed WHERE hypertable_name = 'ai_decisions') AS ai_decisions_analyzed_at,
+                        latest.bit_tq AS current_bit_tq,
+                        latest.data_source AS current_data_source,
+                        latest.timestamp AS current_sample_at,
+                        EXTRACT(EPOCH FROM NOW() - latest.timestamp) AS current_sample_age,
+                        NOW() AS generated_at
+                    FROM (SELECT 1) AS one
+                    LEFT JOIN process_latest latest ON latest.unit_id = %s
+                """, (self.unit_id, self.pending_window, self.unit_id))
+                row = cursor.fetchone()
+            
+            def as_of(value):
+                return value.isoformat() if value else None
             
+            summary = {
+                'total_data_points': row['total_data_points'],
+                'total_ai_decisions': row['total_ai_decisions'],
+                'pending_ai_decisions': row['pending_ai_decisions'],
+                'current_bit_tq': row['current_bit_tq'],
+                'current_data_source': row['current_data_source'],
+                'generated_at': row['generated_at'],
+                'freshness': {
+                    'total_data_points': {'method': 'approximate_row_count', 'as_of': as_of(row['process_data_analyzed_at'])},
+                    'total_ai_decisions': {'method': 'approximate_row_count', 'as_of': as_of(row['ai_decisions_analyzed_at'])},
+                    'pending_ai_decisions': {
+                        'method': 'exact', 'as_of': as_of(row['generated_at']),
+                        'unit_id': self.unit_id, 'window_seconds': self.pending_window
+                    },
+                    'current_bit_tq': {
+                        'method': 'process_latest', 'as_of': as_of(row['current_sample_at']),
+                        'stale': row['current_sample_age'] is None or float(row['current_sample_age']) > self.stale_after
+                    },
+                    'cache_age_seconds': 0.0
+                }
+            }
+            self._status_cache = (time.monotonic(), summary)
+            return summary
+    
+    def get_live_state(self) -> Dict:
+        """Stato per lo stream live: ultimo campione e decisione pendente in un'unica query"""
+        with self.db_pool.connection() as conn:
+            cursor = conn.cursor()
+            self.db_pool.execute_prepared(cursor, 'live_state', (self.unit_id,))
+            process, decision = cursor.fetchone()
+        return {'process': process, 'decision': decision}
+    
+    def claim_pending_decision(self) -> Optional[Dict]:
+        """Prende in carico la decisione pendente più recente (UPDATE ... FOR UPDATE SKIP LOCKED)
+
+        Un solo round-trip: worker concorrenti ottengono righe diverse o nessuna.
+        Riprende anche i claim scaduti (più vecchi di claim_timeout secondi).
+        """
+        with self.db_pool.connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            self.db_pool.execute_prepared(cursor, 'claim_decision', (self.unit_id, self.worker_id, self.claim_timeout))
+            result = cursor.fetchone()
+            conn.commit()
+        
+        if result:
+            decision = dict(result)
+            decision['parameters_changed'] = decision['parameters_changed'] or {}
+            logger.info(f"🔒 Claimed AI decision ID={decision['id']}, timestamp={decision['timestamp']}")
+            return decision
+        return None
+    
+    def finalize_decision(self, decision: Dict, applied: bool, error: Optional[str] = None) -> bool:
+        """Chiude un claim come applied o failed; False se il claim è scaduto ed è stato ripreso"""
+        state = 'applied' if applied else 'failed'
+        with self.db_pool.connection() as conn:
+            cursor = conn.cursor()
+            self.db_pool.execute_prepared(cursor, 'finalize_decision', (
+                state, error, decision['id'], decision['timestamp'], self.worker_id, decision['claimed_at']
+            ))
             rows_affected = cursor.rowcount
             conn.commit()
-            conn.close()
-            
-            if rows_affected > 0:
-                logger.info(f"✅ Decision marked as applied (ID: {decision_id})")
-                return True
-            else:
-                logger.warning("⚠️ No decision was marked as applied")
-                return False
-            
-        except Exception as e:
-            logger.error(f"Error marking decision as applied: {e}")
-            return False
+        
+        if rows_affected > 0:
+            logger.info(f"✅ Decision {decision['id']} marked as {state}")
+            return True
+        logger.warning(f"⚠️ Claim on decision {decision['id']} expired before finalization")
+        return False
 
 # Inizializza l'applier
 applier = AIDecisionApplier()
+opc_writer = OPCWriter(applier, timeout=float(os.getenv('OPC_WRITE_TIMEOUT', '10')))
+broadcaster = LiveBroadcaster(applier.get_live_state, interval=float(os.getenv('STREAM_TICK_SECONDS', '2')))
+
+def handle_notification(channel: str, event: Dict) -> None:
+    """Nuove decisioni o nuovi campioni dell'unità servita: invalida le cache e sveglia lo stream"""
+    if event.get('unit_id') != applier.unit_id:
+        return
+    if channel == 'ai_decisions':
+        applier.invalidate_decisions()
+    broadcaster.wake()
+
+notification_listener = NotificationListener(
+    applier.db_config, ('ai_decisions', 'process_data'),
+    on_notify=handle_notification, on_state=applier.set_notifications_live
+)
+
+@app.before_request
+def start_notification_listener():
+    notification_listener.start()
+
+@app.route('/api/stream', methods=['GET'])
+def stream_live_state():
+    """Endpoint Server-Sent Events: snapshot iniziale, poi delta di processo e decisioni"""
+    def generate():
+        subscriber = broadcaster.subscribe()
+        try:
+            while True:
+                try:
+                    event, payload = subscriber.get(timeout=15)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event}\nid: {payload['version']}\ndata: {json.dumps(payload, default=str)}\n\n"
+        finally:
+            broadcaster.unsubscribe(subscriber)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/api/process/current', methods=['GET'])
 def get_current_process_data():
@@ -236,7 +1035,10 @@ def get_current_process_data():
                     'fc1065': data.get('fc1065'),
                     'li40054': data.get('li40054'),
                     'fc31007': data.get('fc31007'),
-                    'pi18213': data.get('pi18213')
+                    'pi18213': data.get('pi18213'),
+                    'unit_id': data['unit_id'],
+                    'age_seconds': round(data['age_seconds'], 3),
+                    'stale': data['stale']
                 }
             })
         else:
@@ -267,15 +1069,13 @@ def get_latest_decision():
         else:
             # Conta il totale delle decisioni per debug
             try:
-                conn = psycopg2.connect(**applier.db_config)
-                cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM ai_decisions")
-                total_decisions = cursor.fetchone()[0]
-                
-                cursor.execute("SELECT COUNT(*) FROM ai_decisions WHERE decision_applied = false")
-                pending_decisions = cursor.fetchone()[0]
-                
-                conn.close()
+                with applier.db_pool.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT COUNT(*) FROM ai_decisions")
+                    total_decisions = cursor.fetchone()[0]
+                    
+                    cursor.execute("SELECT COUNT(*) FROM ai_decisions WHERE state = 'pending'")
+                    pending_decisions = cursor.fetchone()[0]
                 
                 return jsonify({
                     'success': False,
@@ -300,8 +1100,8 @@ def get_latest_decision():
 def apply_ai_decision():
     """Endpoint per applicare l'ultima decisione AI - VERSIONE CORRETTA"""
     try:
-        # Recupera l'ultima decisione
-        decision = applier.get_latest_ai_decision()
+        # Prende in carico l'ultima decisione pendente (esclusiva tra worker/repliche)
+        decision = applier.claim_pending_decision()
         if not decision:
             return jsonify({
                 'success': False,
@@ -310,12 +1110,15 @@ def apply_ai_decision():
         
         logger.info(f"Applying AI decision: ID={decision['id']}")
         
-        # Applica i parametri
-        success = asyncio.run(applier.apply_ai_parameters(decision['parameters_changed']))
+        # Applica i parametri; il claim viene chiuso anche se la scrittura fallisce
+        try:
+            result = opc_writer.apply(decision['parameters_changed'])
+        except Exception as e:
+            applier.finalize_decision(decision, False, str(e))
+            raise
         
-        if success:
-            # Marca come applicata
-            mark_success = applier.mark_decision_as_applied(decision['id'], decision['timestamp'])
+        if result['success']:
+            finalized = applier.finalize_decision(decision, True)
             
             return jsonify({
                 'success': True,
@@ -325,12 +1128,17 @@ def apply_ai_decision():
                 'confidence': decision['confidence'],
                 'decision_id': decision['id'],
                 'timestamp': decision['timestamp'].isoformat(),
-                'marked_as_applied': mark_success
+                'marked_as_applied': finalized,
+                'tag_status': result['tag_status']
             })
         else:
+            failed_tags = {name: status for name, status in result['tag_status'].items() if status != 'Good'}
+            applier.finalize_decision(decision, False, result.get('error') or json.dumps(failed_tags))
             return jsonify({
                 'success': False,
-                'message': 'Failed to apply AI decision to OPC-UA server'
+                'message': 'Failed to apply AI decision to OPC-UA server',
+                'decision_id': decision['id'],
+                'tag_status': result['tag_status']
             })
             
     except Exception as e:
@@ -353,17 +1161,19 @@ def reset_to_human_control():
             'operator_mode': 0.0  # Human control
         }
         
-        success = asyncio.run(applier.apply_ai_parameters(baseline_params))
+        result = opc_writer.apply(baseline_params)
         
-        if success:
+        if result['success']:
             return jsonify({
                 'success': True,
-                'message': 'Process reset to human control'
+                'message': 'Process reset to human control',
+                'tag_status': result['tag_status']
             })
         else:
             return jsonify({
                 'success': False,
-                'message': 'Failed to reset process'
+                'message': 'Failed to reset process',
+                'tag_status': result['tag_status']
             })
             
     except Exception as e:
@@ -407,34 +1217,34 @@ def force_generate_ai_decision():
         hourly_savings = 185.0
         
         # Inserisci decisione nel database
-        conn = psycopg2.connect(**applier.db_config)
-        cursor = conn.cursor()
-        
-        decision_timestamp = datetime.now()
-        
-        cursor.execute("""
-            INSERT INTO ai_decisions (
-                timestamp, decision_type, confidence, predicted_bit_tq,
-                predicted_energy_saving, predicted_co2_reduction, 
-                parameters_changed, baseline_values, savings_eur_hour,
-                anomaly_detected, decision_applied
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            decision_timestamp,
-            'forced_optimization',
-            0.82,
-            predicted_bit_tq,
-            energy_saving,
-            co2_reduction,
-            json.dumps(optimized_params),
-            json.dumps(baseline_params),
-            hourly_savings,
-            current_bit_tq < 45.0,
-            False
-        ))
-        
-        conn.commit()
-        conn.close()
+        with applier.db_pool.connection() as conn:
+            cursor = conn.cursor()
+            
+            decision_timestamp = datetime.now()
+            
+            cursor.execute("""
+                INSERT INTO ai_decisions (
+                    timestamp, decision_type, confidence, predicted_bit_tq,
+                    predicted_energy_saving, predicted_co2_reduction, 
+                    parameters_changed, baseline_values, savings_eur_hour,
+                    anomaly_detected, decision_applied, unit_id
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (
+                decision_timestamp,
+                'forced_optimization',
+                0.82,
+                predicted_bit_tq,
+                energy_saving,
+                co2_reduction,
+                json.dumps(optimized_params),
+                json.dumps(baseline_params),
+                hourly_savings,
+                current_bit_tq < 45.0,
+                False,
+                applier.unit_id
+            ))
+            
+            conn.commit()
         
         logger.info(f"✅ Forced AI decision generated at: {decision_timestamp}")
         
@@ -460,28 +1270,20 @@ def force_generate_ai_decision():
             'message': f'Error: {str(e)}'
         })
 
+@app.route('/api/pool/metrics', methods=['GET'])
+def get_pool_metrics():
+    """Endpoint per le metriche del pool di connessioni al database"""
+    return jsonify({
+        'success': True,
+        'db_pool': applier.db_pool.snapshot()
+    })
+
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Endpoint per lo status dettagliato dell'API"""
     try:
-        conn = psycopg2.connect(**applier.db_config)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM process_data")
-        data_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM ai_decisions WHERE decision_applied = false")
-        pending_decisions = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM ai_decisions")
-        total_decisions = cursor.fetchone()[0]
-        
-        # Ottieni dati processo attuali
-        current_data = applier.get_current_process_data()
-        current_bit_tq = current_data['bit_tq'] if current_data else None
-        current_source = current_data['data_source'] if current_data else None
-        
-        conn.close()
+        summary = applier.get_status_summary()
+        current_source = summary['current_data_source']
         
         return jsonify({
             'success': True,
@@ -489,13 +1291,20 @@ def get_status():
             'system_status': {
                 'database_connected': True,
                 'database_type': 'TimescaleDB hypertable',
-                'total_data_points': data_count,
-                'pending_ai_decisions': pending_decisions,
-                'total_ai_decisions': total_decisions,
-                'current_bit_tq': current_bit_tq,
+                'total_data_points': summary['total_data_points'],
+                'pending_ai_decisions': summary['pending_ai_decisions'],
+                'total_ai_decisions': summary['total_ai_decisions'],
+                'current_bit_tq': summary['current_bit_tq'],
                 'current_data_source': current_source,
                 'is_ai_control': current_source == 'ai_control' if current_source else False,
-                'last_check': datetime.now().isoformat()
+                'last_check': summary['generated_at'].isoformat(),
+                'freshness': summary['freshness'],
+                'db_pool': applier.db_pool.snapshot(),
+                'stream_clients': broadcaster.client_count,
+                'notifications_connected': notification_listener.connected,
+                'notifications_received': notification_listener.notifications,
+                'opc_session_connected': applier.opc_session.connected,
+                'opc_reconnects': applier.opc_session.reconnect_count
             },
             'endpoints': [
                 '/api/ai-decisions/latest',
@@ -503,7 +1312,9 @@ def get_status():
                 '/api/ai-decisions/force-generate',
                 '/api/process/current',
                 '/api/process/reset',
-                '/api/status'
+                '/api/pool/metrics',
+                '/api/status',
+                '/api/stream'
             ]
         })
         
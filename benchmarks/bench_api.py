@@ -0,0 +1,459 @@
+"""
+Demo Demo - Benchmark di carico HTTP dell'API server
+Simula N dashboard che interrogano l'API con lo stesso mix di richieste di
+ai-control-dashboard.html (checkStatus: /api/process/current poi /api/status;
+"Ultima decisione": /api/ai-decisions/latest), contro un database locale
+popolato a diversi volumi di dati. Per scenario (volume x dashboard concorrenti)
+riporta throughput e latenze p50/p95/p99 per endpoint, le connessioni al database
+viste da pg_stat_activity e le metriche per endpoint del pool dell'API.
+
+L'API gira in un processo dedicato con il server WSGI threaded di werkzeug (lo
+stesso di app.run); con --url si misura invece un server già avviato.
+Senza --pending il database non contiene decisioni in attesa: /latest percorre
+il ramo con i COUNT(*) di debug, il caso peggiore.
+
+Il database è BENCH_DB_NAME (default refinery_bench_api, sempre con prefisso
+refinery_bench; il DB_NAME dei servizi viene ignorato). Solo con --init-db viene
+ricreato e ripopolato per ogni volume; senza, si misura il contenuto attuale.
+
+Uso:
+    python benchmarks/bench_api.py --init-db --volumes 10000,1000000 --clients 10,50,100 --duration 30
+    python benchmarks/bench_api.py --compare benchmarks/results/api-<baseline>.json
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import asyncpg
+import psycopg2
+
+from common import (REPO_ROOT, bench_db_config, compare_results, db_config_from_env, init_database,
+                    percentiles, write_results)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BENCH_DATABASE = 'refinery_bench_api'
+STATUS_PATHS = ('/api/process/current', '/api/status')
+LATEST_PATH = '/api/ai-decisions/latest'
+ENDPOINT_PATHS = STATUS_PATHS + (LATEST_PATH,)
+
+REGRESSION_METRICS = {
+    'total_rps': 'higher',
+    **{f"endpoints.{path}.p95_ms": 'lower' for path in ENDPOINT_PATHS},
+    'db_connections.max': 'lower'
+}
+
+
+async def seed_database(db_config: Dict, rows: int, units: int, pending: bool) -> None:
+    """Popola process_data (rows campioni su `units` unità, negli ultimi ~27 giorni), decisioni e anomalie"""
+    # Sotto la retention di 30 giorni: le policy non cancellano i dati durante il benchmark
+    span_seconds = 27 * 24 * 3600
+    conn = await asyncpg.connect(**db_config)
+    try:
+        await conn.execute("""
+            INSERT INTO process_data (
+                timestamp, fc1065, li40054, fc31007, pi18213, bit_tq, energy_consumption,
+                co2_emissions, hvbgo_flow, temperature_flash, process_efficiency, data_source, unit_id
+            )
+            SELECT NOW() - make_interval(secs => g * $2::float8 / $1),
+                127.3 + random() * 5, 68.2 + random() * 3, 89.1 + random() * 3, 2.14 + random() * 0.1,
+                40 + random() * 12, 1200 + random() * 150, 33 + random() * 3, 155 + random() * 4,
+                415 + random() * 10, 70 + random() * 20,
+                CASE WHEN g % 3 = 0 THEN 'ai_control' ELSE 'human_control' END,
+                'unit-' || (g % $3 + 1)
+            FROM generate_series(1, $1) AS g
+        """, rows, span_seconds, units)
+
+        decisions = max(1, rows // 100)
+        await conn.execute("""
+            INSERT INTO ai_decisions (
+                timestamp, decision_type, confidence, predicted_bit_tq, predicted_energy_saving,
+                predicted_co2_reduction, parameters_changed, baseline_values, savings_eur_hour,
+                anomaly_detected, decision_applied, operator_approved, state, applied_at, unit_id
+            )
+            SELECT NOW() - make_interval(secs => g * $2::float8 / $1),
+                'optimization', 0.8 + random() * 0.15, 48 + random() * 5, 0.05 + random() * 0.05,
+                0.05 + random() * 0.1,
+                '{"fc1065": 132.0, "li40054": 71.2, "fc31007": 86.8, "pi18213": 2.22}',
+                '{"fc1065": 127.3, "li40054": 68.2, "fc31007": 89.1, "pi18213": 2.14}',
+                100 + random() * 200, false, true, true, 'applied',
+                NOW() - make_interval(secs => g * $2::float8 / $1), 'unit-' || (g % $3 + 1)
+            FROM generate_series(1, $1) AS g
+        """, decisions, span_seconds, units)
+        # La decisione di esempio di init_db.sql non deve falsare lo scenario senza pendenti
+        await conn.execute("""
+            UPDATE ai_decisions SET state = 'applied', decision_applied = true, applied_at = timestamp
+            WHERE state = 'pending'
+        """)
+        if pending:
+            await conn.execute("""
+                INSERT INTO ai_decisions (
+                    timestamp, decision_type, confidence, predicted_bit_tq, predicted_energy_saving,
+                    predicted_co2_reduction, parameters_changed, baseline_values, savings_eur_hour,
+                    anomaly_detected, decision_applied, unit_id
+                )
+                SELECT NOW() - INTERVAL '1 minute', 'optimization', 0.85, 52.3, 0.08, 0.12,
+                    '{"fc1065": 132.0, "li40054": 71.2, "fc31007": 86.8, "pi18213": 2.22}',
+                    '{"fc1065": 127.3, "li40054": 68.2, "fc31007": 89.1, "pi18213": 2.14}',
+                    195.0, false, false, 'unit-' || u
+                FROM generate_series(1, $1) AS u
+            """, units)
+
+        await conn.execute("""
+            INSERT INTO anomalies (
+                timestamp, anomaly_type, severity, parameter_name, normal_range_min,
+                normal_range_max, actual_value, deviation_percentage, unit_id
+            )
+            SELECT NOW() - make_interval(secs => g * $2::float8 / $1), 'BIT_TQ_OUT_OF_RANGE', 3,
+                'bit_tq', 35, 65, 30 + random() * 4, 35, 'unit-' || (g % $3 + 1)
+            FROM generate_series(1, $1) AS g
+        """, max(1, rows // 50), span_seconds, units)
+
+        await conn.execute("DELETE FROM process_latest")
+        await conn.execute("""
+            INSERT INTO process_latest (
+                unit_id, timestamp, fc1065, li40054, fc31007, pi18213, bit_tq, energy_consumption,
+                co2_emissions, hvbgo_flow, temperature_flash, process_efficiency, data_source
+            )
+            SELECT DISTINCT ON (unit_id)
+                unit_id, timestamp, fc1065, li40054, fc31007, pi18213, bit_tq, energy_consumption,
+                co2_emissions, hvbgo_flow, temperature_flash, process_efficiency, data_source
+            FROM process_data
+            ORDER BY unit_id, timestamp DESC
+        """)
+        # Statistiche aggiornate: approximate_row_count e i piani dipendono da ANALYZE
+        await conn.execute("ANALYZE")
+    finally:
+        await conn.close()
+    logger.info(f"🌱 Seeded {rows} process rows on {units} units "
+                f"({'with' if pending else 'without'} pending decisions)")
+
+
+def serve_api(port: int, env: Dict[str, str]) -> None:
+    """Entry point del processo API: importa app.py con l'ambiente del benchmark"""
+    os.environ.update(env)
+    sys.path.insert(0, os.path.join(REPO_ROOT, 'api-server'))
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    from werkzeug.serving import make_server
+    import app as api
+
+    make_server('127.0.0.1', port, api.app, threaded=True).serve_forever()
+
+
+def wait_ready(base_url: str, timeout: float = 60.0) -> None:
+    parts = urlsplit(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+            conn.request('GET', '/api/pool/metrics')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"API server at {base_url} not ready after {timeout}s")
+
+
+def fetch_json(base_url: str, path: str) -> Dict:
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+    try:
+        conn.request('GET', path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def _is_app_error(payload: Dict) -> bool:
+    """Risposta 200 che riporta un errore di database (gli handler restituiscono success=False)"""
+    message = payload.get('message', '')
+    return payload.get('success') is False and ('rror' in message or 'could not' in message)
+
+
+class LoadResults:
+    """Latenze ed errori per endpoint, condivisi tra i thread dei dashboard"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.app_errors: Dict[str, int] = defaultdict(int)
+        self.unsuccessful: Dict[str, int] = defaultdict(int)  # success=False per qualunque motivo
+        self._lock = threading.Lock()
+        self.recording = False
+
+    def record(self, path: str, latency_ms: float, error: bool, payload: Optional[Dict]) -> None:
+        if not self.recording:
+            return
+        with self._lock:
+            self.latencies[path].append(latency_ms)
+            if error:
+                self.errors[path] += 1
+            elif payload.get('success') is False:
+                self.unsuccessful[path] += 1
+                if _is_app_error(payload):
+                    self.app_errors[path] += 1
+
+
+def dashboard(base_url: str, results: LoadResults, stop: threading.Event, think_time: float,
+              latest_ratio: float, seed: int) -> None:
+    """Un dashboard: checkStatus (current + status), a volte l'ultima decisione, poi pausa"""
+    parts = urlsplit(base_url)
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+
+    # Partenze sfalsate: i dashboard reali non si sincronizzano
+    if think_time:
+        stop.wait(rng.uniform(0, think_time))
+
+    while not stop.is_set():
+        paths = list(STATUS_PATHS)
+        if rng.random() < latest_ratio:
+            paths.append(LATEST_PATH)
+        for path in paths:
+            start = time.perf_counter()
+            error, payload = False, None
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                body = response.read()
+                if response.status != 200:
+                    error = True
+                else:
+                    payload = json.loads(body)
+            except (OSError, http.client.HTTPException, ValueError):
+                error = True
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+            results.record(path, (time.perf_counter() - start) * 1000, error, payload)
+        if think_time:
+            stop.wait(think_time * rng.uniform(0.5, 1.5))
+    conn.close()
+
+
+class ConnectionSampler(threading.Thread):
+    """Campiona le connessioni al database del benchmark da pg_stat_activity"""
+
+    def __init__(self, db_config: Dict, interval: float = 0.25):
+        super().__init__(name='pg-stat-sampler', daemon=True)
+        self.db_config = db_config
+        self.interval = interval
+        self.samples: List[tuple] = []  # (totali, attive)
+        self.stop_event = threading.Event()
+        self.recording = False
+
+    def run(self):
+        try:
+            conn = psycopg2.connect(**self.db_config)
+        except psycopg2.Error as e:
+            logger.warning(f"⚠️ pg_stat_activity sampling disabled: {e}")
+            return
+        conn.autocommit = True
+        cursor = conn.cursor()
+        try:
+            while not self.stop_event.wait(self.interval):
+                cursor.execute("""
+                    SELECT COUNT(*), COUNT(*) FILTER (WHERE state = 'active')
+                    FROM pg_stat_activity
+                    WHERE datname = %s AND pid <> pg_backend_pid()
+                """, (self.db_config['database'],))
+                if self.recording:
+                    self.samples.append(cursor.fetchone())
+        finally:
+            conn.close()
+
+    def summary(self) -> Dict:
+        if not self.samples:
+            return {}
+        totals = [total for total, _ in self.samples]
+        return {
+            'max': max(totals),
+            'mean': round(sum(totals) / len(totals), 1),
+            'max_active': max(active for _, active in self.samples),
+            'samples': len(self.samples)
+        }
+
+
+def _pool_delta(before: Dict, after: Dict) -> Dict:
+    """Differenza delle metriche del pool dell'API durante la finestra misurata"""
+    counters = ('checkouts', 'waits', 'timeouts', 'opened', 'closed', 'recycled', 'health_check_failures')
+    delta = {key: after.get(key, 0) - before.get(key, 0) for key in counters}
+    delta.update({'open': after.get('open'), 'max_size': after.get('max_size')})
+    delta['by_endpoint'] = {
+        name: {key: values.get(key, 0) - before.get('by_endpoint', {}).get(name, {}).get(key, 0) for key in values}
+        for name, values in after.get('by_endpoint', {}).items()
+    }
+    delta['queries'] = after.get('queries', {})
+    return delta
+
+
+def run_load(base_url: str, db_config: Dict, clients: int, duration: float, warmup: float,
+             think_time: float, latest_ratio: float) -> Dict:
+    results = LoadResults()
+    stop = threading.Event()
+    sampler = ConnectionSampler(db_config)
+    sampler.start()
+    threads = [
+        threading.Thread(target=dashboard, name=f"dashboard-{index}", daemon=True,
+                         args=(base_url, results, stop, think_time, latest_ratio, index))
+        for index in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+
+    time.sleep(warmup)
+    pool_before = fetch_json(base_url, '/api/pool/metrics').get('db_pool', {})
+    results.recording = sampler.recording = True
+    start = time.perf_counter()
+    time.sleep(duration)
+    results.recording = sampler.recording = False
+    elapsed = time.perf_counter() - start
+    pool_after = fetch_json(base_url, '/api/pool/metrics').get('db_pool', {})
+
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=35)
+    sampler.stop_event.set()
+    sampler.join(timeout=5)
+
+    endpoints = {}
+    for path in ENDPOINT_PATHS:
+        latencies = results.latencies.get(path, [])
+        endpoints[path] = {
+            'requests': len(latencies),
+            'rps': round(len(latencies) / elapsed, 2),
+            'errors': results.errors.get(path, 0),
+            'app_errors': results.app_errors.get(path, 0),
+            'unsuccessful': results.unsuccessful.get(path, 0),
+            **percentiles(latencies)
+        }
+    return {
+        'duration_s': round(elapsed, 3),
+        'total_rps': round(sum(endpoint['requests'] for endpoint in endpoints.values()) / elapsed, 2),
+        'endpoints': endpoints,
+        'db_connections': sampler.summary(),
+        'api_pool': _pool_delta(pool_before, pool_after)
+    }
+
+
+def start_api(port: int, db_config: Dict) -> multiprocessing.Process:
+    env = {
+        'DB_HOST': db_config['host'], 'DB_NAME': db_config['database'],
+        'DB_USER': db_config['user'], 'DB_PASSWORD': db_config['password']
+    }
+    process = multiprocessing.get_context('spawn').Process(target=serve_api, args=(port, env),
+                                                            name='api-server', daemon=True)
+    process.start()
+    return process
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load benchmark for the API server dashboard endpoints")
+    parser.add_argument('--volumes', type=_int_list, default=[10000, 100000, 1000000],
+                        help="Righe di process_data per cui ripopolare il database con --init-db (es. 10000,1000000)")
+    parser.add_argument('--clients', type=_int_list, default=[10, 50, 100], help="Dashboard concorrenti da provare")
+    parser.add_argument('--duration', type=float, default=30.0, help="Secondi misurati per scenario")
+    parser.add_argument('--warmup', type=float, default=3.0, help="Secondi di warmup esclusi dalle statistiche")
+    parser.add_argument('--think-time', type=float, default=0.0,
+                        help="Pausa media tra due cicli di un dashboard (0 = ciclo chiuso alla massima velocità; "
+                             "il dashboard reale usa 30)")
+    parser.add_argument('--latest-ratio', type=float, default=0.5,
+                        help="Frazione dei cicli che richiedono anche l'ultima decisione AI")
+    parser.add_argument('--units', type=int, default=1, help="Unità su cui distribuire i dati generati")
+    parser.add_argument('--pending', action='store_true', help="Inserisce una decisione pendente per unità")
+    parser.add_argument('--port', type=int, default=5055, help="Porta dell'API avviata dal benchmark")
+    parser.add_argument('--init-db', action='store_true',
+                        help=f"Ricrea (DROP/CREATE) e ripopola il database (BENCH_DB_NAME, default {BENCH_DATABASE}) "
+                             "per ogni volume")
+    parser.add_argument('--url', help="API già in esecuzione (es. http://localhost:5000): niente seed né avvio")
+    parser.add_argument('--output', help="File JSON dei risultati (default benchmarks/results/api-<timestamp>.json)")
+    parser.add_argument('--compare', help="JSON di baseline con cui confrontare i risultati")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Variazione relativa tollerata nel confronto")
+    args = parser.parse_args()
+
+    if args.url:
+        if args.init_db:
+            parser.error("--init-db cannot be used with --url")
+        # Solo per campionare pg_stat_activity del database servito dall'API esterna
+        db_config = db_config_from_env('refinery_db')
+    else:
+        try:
+            db_config = bench_db_config(BENCH_DATABASE)
+        except ValueError as e:
+            parser.error(str(e))
+    scenarios = []
+    volumes: List[Optional[int]] = args.volumes if args.init_db else [None]
+
+    for volume in volumes:
+        api_process = None
+        if args.url:
+            base_url = args.url
+        else:
+            if volume is not None:
+                asyncio.run(init_database(db_config))
+                asyncio.run(seed_database(db_config, volume, args.units, args.pending))
+            api_process = start_api(args.port, db_config)
+            base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            wait_ready(base_url)
+            for clients in args.clients:
+                if volume is not None:
+                    name = f"v{volume}-c{clients}"
+                else:
+                    name = f"{'external' if args.url else 'current'}-c{clients}"
+                logger.info(f"🏁 Scenario {name}: {clients} dashboards, {args.duration:.0f}s")
+                result = {
+                    'name': name, 'volume': volume, 'clients': clients,
+                    **run_load(base_url, db_config, clients, args.duration, args.warmup,
+                               args.think_time, args.latest_ratio)
+                }
+                for path, endpoint in result['endpoints'].items():
+                    if endpoint['requests']:
+                        logger.info(f"📈 {name} {path}: {endpoint['rps']:.1f} req/s, p50 {endpoint['p50_ms']:.1f} ms, "
+                                    f"p95 {endpoint['p95_ms']:.1f} ms, p99 {endpoint['p99_ms']:.1f} ms, "
+                                    f"{endpoint['errors'] + endpoint['app_errors']} errors")
+                connections = result['db_connections']
+                pool = result['api_pool']
+                logger.info(f"🗄️ {name}: {result['total_rps']:.1f} req/s total, DB connections max "
+                            f"{connections.get('max', '?')} (active {connections.get('max_active', '?')}), "
+                            f"pool waits {pool.get('waits', 0)}, timeouts {pool.get('timeouts', 0)}")
+                scenarios.append(result)
+        finally:
+            if api_process is not None:
+                api_process.terminate()
+                api_process.join(timeout=10)
+
+    config = {key: value for key, value in vars(args).items() if key not in ('compare', 'output')}
+    config['database'] = db_config['database']
+    write_results('api', config, scenarios, args.output)
+
+    if args.compare:
+        regressions = compare_results(args.compare, scenarios, REGRESSION_METRICS, args.tolerance)
+        if regressions:
+            logger.error(f"❌ {len(regressions)} regressions: {'; '.join(regressions)}")
+            sys.exit(1)
+        logger.info("✅ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""
+Demo Demo - Benchmark della pipeline di ingestione del collector
+Esegue RefineryDataClient contro server OPC-UA sostitutivi (opc_standin.py) e un
+Postgres/TimescaleDB locale, per ogni combinazione di numero di unità e di tag:
+campioni al secondo, percentili di latenza per stadio (lettura OPC, AIMock,
+rilevatore anomalie, scrittura DB), CPU e RSS del processo collector.
+Ogni scenario gira in un processo separato (RSS e CPU non si sommano tra scenari)
+e i risultati vengono salvati in JSON; con --compare vengono confrontati con una
+baseline e il processo termina con codice 1 in caso di regressioni.
+Il database è BENCH_DB_NAME (default refinery_bench, sempre con prefisso
+refinery_bench): il DB_NAME dei servizi viene ignorato.
+
+Uso:
+    python benchmarks/bench_ingestion.py --init-db --units 1,4,16 --tags 11,100,500 --duration 30
+    python benchmarks/bench_ingestion.py --compare benchmarks/results/ingestion-<baseline>.json
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python-client'))
+
+from common import (ProcessUsage, bench_db_config, compare_results, database_reachable,
+                    init_database, percentiles, write_results)
+from opc_standin import start_servers, stop_servers
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BENCH_DATABASE = 'refinery_bench'
+
+# Metriche confrontate con la baseline: direzione migliore
+REGRESSION_METRICS = {
+    'samples_per_s': 'higher',
+    'stages.opc_read.p95_ms': 'lower',
+    'stages.aimock_should_generate.p95_ms': 'lower',
+    'stages.anomaly_detector.p95_ms': 'lower',
+    'stages.db_write.p95_ms': 'lower',
+    'resources.cpu_percent': 'lower',
+    'resources.peak_rss_mb': 'lower'
+}
+
+
+class StageTimer:
+    """Latenze per stadio raccolte avvolgendo i metodi dell'istanza"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._active: Dict[str, int] = defaultdict(int)
+
+    def reset(self) -> None:
+        self.samples.clear()
+
+    def wrap(self, name: str, func, outer: Optional[str] = None):
+        """Con outer, le chiamate annidate dentro quello stadio non vengono registrate (già incluse nel suo tempo)"""
+        def timed(*args, **kwargs):
+            if outer is not None and self._active[outer]:
+                return func(*args, **kwargs)
+            self._active[name] += 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.samples[name].append((time.perf_counter() - start) * 1000)
+                self._active[name] -= 1
+        return timed
+
+    def wrap_async(self, name: str, func):
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.samples[name].append((time.perf_counter() - start) * 1000)
+        return timed
+
+    def summary(self) -> Dict[str, Dict]:
+        return {name: percentiles(values) for name, values in sorted(self.samples.items())}
+
+
+class ScenarioStats:
+    """Contatori del benchmark non esposti dal client (letture in fallback, righe per batch)"""
+
+    def __init__(self, tags: int):
+        self.tags = tags
+        self.reads = 0
+        self.fallback_reads = 0
+        self.batch_rows: List[int] = []
+
+    def reset(self) -> None:
+        self.reads = self.fallback_reads = 0
+        self.batch_rows = []
+
+
+def instrument(client, timer: StageTimer, stats: ScenarioStats) -> None:
+    """Misura gli stadi della pipeline senza modificarne il comportamento"""
+    read_opc_data = timer.wrap_async('opc_read', client.read_opc_data)
+
+    async def counted_read(unit):
+        unit.last_read_status = {}
+        data = await read_opc_data(unit)
+        stats.reads += 1
+        # Lettura reale solo se tutti i tag sono Good: altrimenti il client ha usato i dati di fallback
+        if sum(1 for status in unit.last_read_status.values() if status == 'Good') < stats.tags:
+            stats.fallback_reads += 1
+        return data
+
+    client.read_opc_data = counted_read
+    client.process_sample = timer.wrap_async('process_sample', client.process_sample)
+    client._run_decision_stage = timer.wrap_async('decision_stage', client._run_decision_stage)
+
+    for unit in client.units:
+        # generate_optimization_decision richiama should_generate_decision (ora l'attributo avvolto):
+        # solo la chiamata esterna del client finisce in aimock_should_generate
+        unit.ai_model.should_generate_decision = timer.wrap(
+            'aimock_should_generate', unit.ai_model.should_generate_decision, outer='aimock_generate')
+        unit.ai_model.generate_optimization_decision = timer.wrap(
+            'aimock_generate', unit.ai_model.generate_optimization_decision)
+        unit.anomaly_detector.update = timer.wrap('anomaly_detector', unit.anomaly_detector.update)
+
+    write = timer.wrap_async('db_write', client.writer._write)
+
+    async def counted_write(rows):
+        stats.batch_rows.append(len(rows))
+        await write(rows)
+
+    client.writer._write = counted_write
+
+
+async def drive(client, duration: float, interval: float) -> int:
+    """Ciclo di scansione come run_demo_cycle, senza lo sleep dinamico: letture concorrenti, poi storage e AI"""
+    deadline = time.perf_counter() + duration
+    cycles = 0
+    while time.perf_counter() < deadline:
+        cycle_start = time.perf_counter()
+        samples = await asyncio.gather(*(client.read_opc_data(unit) for unit in client.units))
+        for unit, current_data in zip(client.units, samples):
+            await client.process_sample(unit, current_data)
+        cycles += 1
+        # interval 0: alla massima velocità, lasciando comunque girare writer e drain
+        await asyncio.sleep(max(0.0, interval - (time.perf_counter() - cycle_start)))
+    return cycles
+
+
+async def _sample_usage(usage: ProcessUsage, every: float = 1.0) -> None:
+    while True:
+        await asyncio.sleep(every)
+        usage.sample()
+
+
+async def _run_scenario(scenario: Dict) -> Dict:
+    from main_client_fixed import RefineryDataClient
+
+    unit_specs = [
+        (f"bench-{scenario['name']}-{index}", url, object_name)
+        for index, (url, object_name) in enumerate(scenario['unit_endpoints'])
+    ]
+    spool_dir = tempfile.mkdtemp(prefix='bench-spool-')
+    client = RefineryDataClient(unit_specs, spool_dir=spool_dir)
+    timer = StageTimer()
+    stats = ScenarioStats(scenario['tags'])
+    usage = ProcessUsage()
+
+    try:
+        await client.initialize()
+        instrument(client, timer, stats)
+
+        # Warmup: connessione, browse dei tag, riempimento del pool; escluso dalle statistiche
+        await drive(client, scenario['warmup'], scenario['interval'])
+        timer.reset()
+        stats.reset()
+        before = client.counters()
+
+        usage.start()
+        sampler = asyncio.create_task(_sample_usage(usage))
+        start = time.perf_counter()
+        cycles = await drive(client, scenario['duration'], scenario['interval'])
+        elapsed = time.perf_counter() - start
+        after = client.counters()
+        sampler.cancel()
+
+        # Coda residua del writer: quanto serve per portare a disco il backlog
+        flush_start = time.perf_counter()
+        await client.close()
+        flush_tail_ms = (time.perf_counter() - flush_start) * 1000
+        resources = usage.stop()
+        final = client.counters()
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    samples = after['samples'] - before['samples']
+    rows_written = final['rows_written'] - before['rows_written']
+    return {
+        'name': scenario['name'],
+        'units': scenario['units'],
+        'tags': scenario['tags'],
+        'endpoints': scenario['endpoints'],
+        'duration_s': round(elapsed, 3),
+        'cycles': cycles,
+        'samples': samples,
+        'samples_per_s': round(samples / elapsed, 2),
+        'rows_written': rows_written,
+        'rows_per_s': round(rows_written / (elapsed + flush_tail_ms / 1000), 2),
+        'rows_failed': final['rows_failed'] - before['rows_failed'],
+        'rows_spooled': final['rows_spooled'] - before['rows_spooled'],
+        'anomalies': final['anomalies'] - before['anomalies'],
+        'opc_reads': stats.reads,
+        'opc_fallback_reads': stats.fallback_reads,
+        'db_batches': len(stats.batch_rows),
+        'db_batch_rows_mean': round(sum(stats.batch_rows) / len(stats.batch_rows), 1) if stats.batch_rows else 0,
+        'flush_tail_ms': round(flush_tail_ms, 1),
+        'stages': timer.summary(),
+        'resources': resources
+    }
+
+
+def run_scenario(scenario: Dict, results, verbose: bool) -> None:
+    """Entry point del processo collector di uno scenario"""
+    logging.getLogger().setLevel(logging.INFO if verbose else logging.WARNING)
+    logging.getLogger('asyncua').setLevel(logging.WARNING)
+    try:
+        results.put(asyncio.run(_run_scenario(scenario)))
+    except Exception as e:
+        results.put({'name': scenario['name'], 'error': repr(e)})
+
+
+def execute(scenario: Dict, args) -> Dict:
+    """Avvia i server OPC-UA dello scenario, esegue il collector in un processo dedicato e li ferma"""
+    endpoints = max(1, -(-scenario['units'] // args.units_per_endpoint))
+    servers = start_servers(endpoints, scenario['units'], scenario['tags'], args.base_port, args.update_interval)
+    try:
+        scenario['endpoints'] = len(servers)
+        scenario['unit_endpoints'] = [(url, object_name) for _, url, objects in servers for object_name in objects]
+
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        process = context.Process(target=run_scenario, args=(scenario, results, args.verbose),
+                                  name=f"bench-{scenario['name']}")
+        process.start()
+        try:
+            result = results.get(timeout=scenario['warmup'] + scenario['duration'] + args.timeout)
+        except queue.Empty:
+            result = {'name': scenario['name'], 'error': 'timeout'}
+        process.join(timeout=30)
+        if process.is_alive():
+            process.kill()
+        return result
+    finally:
+        stop_servers(servers)
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OPC-UA -> TimescaleDB ingestion pipeline")
+    parser.add_argument('--units', type=_int_list, default=[1, 4, 16], help="Numeri di unità da provare (es. 1,4,16)")
+    parser.add_argument('--tags', type=_int_list, default=[11, 100, 500], help="Tag per unità da provare (minimo 11)")
+    parser.add_argument('--duration', type=float, default=30.0, help="Secondi misurati per scenario")
+    parser.add_argument('--warmup', type=float, default=5.0, help="Secondi di warmup esclusi dalle statistiche")
+    parser.add_argument('--interval', type=float, default=0.0,
+                        help="Periodo minimo del ciclo di scansione in secondi (0 = massima velocità)")
+    parser.add_argument('--units-per-endpoint', type=int, default=4, help="Unità servite da ogni processo server OPC-UA")
+    parser.add_argument('--base-port', type=int, default=48500)
+    parser.add_argument('--update-interval', type=float, default=0.5, help="Periodo di aggiornamento dei valori sul server")
+    parser.add_argument('--init-db', action='store_true',
+                        help=f"Ricrea il database (BENCH_DB_NAME, default {BENCH_DATABASE}) da init_db.sql prima di iniziare")
+    parser.add_argument('--output', help="File JSON dei risultati (default benchmarks/results/ingestion-<timestamp>.json)")
+    parser.add_argument('--compare', help="JSON di baseline con cui confrontare i risultati")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Variazione relativa tollerata nel confronto")
+    parser.add_argument('--timeout', type=float, default=120.0, help="Margine oltre warmup+durata prima di abbandonare uno scenario")
+    parser.add_argument('--verbose', action='store_true', help="Log INFO del collector")
+    args = parser.parse_args()
+
+    # Il nome viene da BENCH_DB_NAME (prefisso refinery_bench obbligatorio): un DB_NAME esportato per la
+    # demo viene sovrascritto, perché il collector (processo figlio) legge DB_NAME dall'ambiente
+    try:
+        db_config = bench_db_config(BENCH_DATABASE)
+    except ValueError as e:
+        parser.error(str(e))
+    os.environ['DB_NAME'] = db_config['database']
+    if args.init_db:
+        asyncio.run(init_database(db_config))
+    reachable = asyncio.run(database_reachable(db_config))
+    if not reachable:
+        logger.warning("⚠️ Running without database: db_write measures the failure path and rows go to the spool")
+
+    scenarios = []
+    for units in args.units:
+        for tags in args.tags:
+            scenario = {
+                'name': f"u{units}-t{tags}", 'units': units, 'tags': max(tags, 11),
+                'duration': args.duration, 'warmup': args.warmup, 'interval': args.interval
+            }
+            logger.info(f"🏁 Scenario {scenario['name']}: {units} units x {scenario['tags']} tags, {args.duration:.0f}s")
+            result = execute(scenario, args)
+            if 'error' in result:
+                logger.error(f"❌ Scenario {scenario['name']} failed: {result['error']}")
+            else:
+                stages = result['stages']
+                logger.info(
+                    f"📈 {result['name']}: {result['samples_per_s']:.1f} samples/s, {result['rows_per_s']:.1f} rows/s, "
+                    f"OPC read p95 {stages.get('opc_read', {}).get('p95_ms', 0):.1f} ms, "
+                    f"DB write p95 {stages.get('db_write', {}).get('p95_ms', 0):.1f} ms, "
+                    f"CPU {result['resources']['cpu_percent']:.0f}%, peak RSS {result['resources']['peak_rss_mb']:.0f} MB"
+                    + (f", {result['opc_fallback_reads']} fallback reads" if result['opc_fallback_reads'] else "")
+                )
+            scenarios.append(result)
+
+    config = {key: value for key, value in vars(args).items() if key not in ('compare', 'output')}
+    config['database'] = db_config['database']
+    config['database_reachable'] = reachable
+    write_results('ingestion', config, scenarios, args.output)
+
+    if args.compare:
+        regressions = compare_results(args.compare, [s for s in scenarios if 'error' not in s],
+                                      REGRESSION_METRICS, args.tolerance)
+        if regressions:
+            logger.error(f"❌ {len(regressions)} regressions: {'; '.join(regressions)}")
+            sys.exit(1)
+        logger.info("✅ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Demo Demo - Utilità comuni dei benchmark
+Percentili di latenza, uso CPU/RSS del processo, salvataggio dei risultati in JSON
+e confronto con una baseline per individuare regressioni.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+import asyncpg
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, 'benchmarks', 'results')
+INIT_SQL = os.path.join(REPO_ROOT, 'init_db.sql')
+# Solo i database con questo prefisso possono essere ricreati dai benchmark
+BENCH_DATABASE_PREFIX = 'refinery_bench'
+
+
+def db_config_from_env(default_database: str) -> Dict:
+    """Configurazione DB dalle stesse variabili dei servizi (DB_NAME incluso)"""
+    return {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'database': os.getenv('DB_NAME', default_database),
+        'user': os.getenv('DB_USER', 'postgres'),
+        'password': os.getenv('DB_PASSWORD', 'password'),
+        'port': 5432
+    }
+
+
+def check_bench_database(name: str) -> None:
+    if not name.startswith(BENCH_DATABASE_PREFIX):
+        raise ValueError(f"Refusing to use database '{name}' for benchmarks: "
+                         f"the name must start with '{BENCH_DATABASE_PREFIX}'")
+
+
+def bench_db_config(default_database: str) -> Dict:
+    """Configurazione del database dei benchmark: nome da BENCH_DB_NAME, mai da DB_NAME della demo"""
+    name = os.getenv('BENCH_DB_NAME', default_database)
+    check_bench_database(name)
+    return {**db_config_from_env(default_database), 'database': name}
+
+
+def split_sql_script(script: str) -> List[str]:
+    """Divide uno script SQL in statement (rispetta stringhe, commenti e corpi $$)"""
+    statements, current = [], []
+    index, length = 0, len(script)
+    while index < length:
+        char = script[index]
+        if script.startswith('--', index):
+            end = script.find('\n', index)
+            end = length if end == -1 else end
+            current.append(script[index:end])
+            index = end
+            continue
+        if char == "'" or script.startswith('$$', index):
+            quote = "'" if char == "'" else '$$'
+            end = script.find(quote, index + len(quote))
+            end = length if end == -1 else end + len(quote)
+            current.append(script[index:end])
+            index = end
+            continue
+        if char == ';':
+            statement = ''.join(current).strip()
+            if statement and not all(line.strip().startswith('--') or not line.strip()
+                                     for line in statement.splitlines()):
+                statements.append(statement)
+            current = []
+        else:
+            current.append(char)
+        index += 1
+    statement = ''.join(current).strip()
+    if statement and not all(line.strip().startswith('--') or not line.strip() for line in statement.splitlines()):
+        statements.append(statement)
+    return statements
+
+
+async def init_database(db_config: Dict) -> None:
+    """Ricrea il database dei benchmark e carica init_db.sql, uno statement alla volta"""
+    name = db_config['database']
+    check_bench_database(name)
+    admin = await asyncpg.connect(**{**db_config, 'database': 'postgres'})
+    try:
+        await admin.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        await admin.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        await admin.close()
+
+    with open(INIT_SQL) as file:
+        statements = split_sql_script(file.read())
+    conn = await asyncpg.connect(**db_config)
+    try:
+        for statement in statements:
+            await conn.execute(statement)
+    finally:
+        await conn.close()
+    logger.info(f"🗄️ Database {name} initialized from init_db.sql ({len(statements)} statements)")
+
+
+async def database_reachable(db_config: Dict) -> bool:
+    try:
+        conn = await asyncpg.connect(**db_config, timeout=5)
+    except (OSError, asyncpg.PostgresError, asyncio.TimeoutError) as e:
+        logger.warning(f"⚠️ Database {db_config['database']} on {db_config['host']} unreachable: {e}")
+        return False
+    await conn.close()
+    return True
+
+
+def percentiles(values: Iterable[float]) -> Dict[str, float]:
+    """Riepilogo di una serie di latenze in millisecondi"""
+    data = np.asarray(list(values), dtype=float)
+    if data.size == 0:
+        return {'count': 0}
+    p50, p95, p99 = np.percentile(data, [50, 95, 99])
+    return {
+        'count': int(data.size),
+        'mean_ms': round(float(data.mean()), 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'max_ms': round(float(data.max()), 3)
+    }
+
+
+def current_rss_mb(pid: str = 'self') -> float:
+    """RSS attuale da /proc (Linux); 0 se non disponibile"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class ProcessUsage:
+    """CPU (user+sys) e memoria del processo corrente tra start() e stop()"""
+
+    def __init__(self):
+        self.rss_samples: List[float] = []
+        self._start_cpu = 0.0
+        self._start_wall = 0.0
+
+    @staticmethod
+    def _cpu_seconds() -> float:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    def start(self) -> None:
+        self.rss_samples = [current_rss_mb()]
+        self._start_cpu = self._cpu_seconds()
+        self._start_wall = time.perf_counter()
+
+    def sample(self) -> None:
+        self.rss_samples.append(current_rss_mb())
+
+    def stop(self) -> Dict[str, float]:
+        wall = time.perf_counter() - self._start_wall
+        cpu = self._cpu_seconds() - self._start_cpu
+        self.sample()
+        return {
+            'wall_s': round(wall, 3),
+            'cpu_s': round(cpu, 3),
+            'cpu_percent': round(100 * cpu / wall, 1) if wall else 0.0,
+            'rss_mb': round(self.rss_samples[-1], 1),
+            'rss_max_mb': round(max(self.rss_samples), 1),
+            # ru_maxrss è in KB su Linux: picco dell'intero processo
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict:
+    """Metadati della macchina e del codice per rendere confrontabili i risultati"""
+    return {
+        'git_revision': git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def write_results(kind: str, config: Dict, scenarios: List[Dict], output: Optional[str] = None) -> str:
+    """Salva i risultati in benchmarks/results/<kind>-<timestamp>.json (o in output)"""
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        output = os.path.join(RESULTS_DIR, f"{kind}-{stamp}.json")
+    with open(output, 'w') as file:
+        json.dump({
+            'benchmark': kind,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'environment': environment(),
+            'config': config,
+            'scenarios': scenarios
+        }, file, indent=2, default=str)
+    logger.info(f"💾 Results written to {output}")
+    return output
+
+
+def _lookup(values: Dict, path: str):
+    for key in path.split('.'):
+        if not isinstance(values, dict) or key not in values:
+            return None
+        values = values[key]
+    return values
+
+
+def compare_results(baseline_path: str, scenarios: List[Dict], metrics: Dict[str, str],
+                    tolerance: float) -> List[str]:
+    """Confronta gli scenari con una baseline (stesso 'name')
+
+    metrics: percorso puntato della metrica -> 'higher' o 'lower' (direzione migliore).
+    Restituisce le regressioni oltre la tolleranza relativa.
+    """
+    with open(baseline_path) as file:
+        baseline = {scenario['name']: scenario for scenario in json.load(file)['scenarios']}
+
+    regressions = []
+    for scenario in scenarios:
+        previous = baseline.get(scenario['name'])
+        if previous is None:
+            logger.info(f"ℹ️ {scenario['name']}: not in baseline")
+            continue
+        for path, better in metrics.items():
+            old, new = _lookup(previous, path), _lookup(scenario, path)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change < -tolerance if better == 'higher' else change > tolerance
+            marker = '❌' if worse else '✅'
+            logger.info(f"{marker} {scenario['name']} {path}: {old:.2f} -> {new:.2f} ({change:+.1%})")
+            if worse:
+                regressions.append(f"{scenario['name']} {path} {change:+.1%}")
+    return regressions
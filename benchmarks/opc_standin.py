@@ -0,0 +1,137 @@
+"""
+Demo Demo - Server OPC-UA sostitutivo per i benchmark
+Espone N oggetti Refinery1..N, ciascuno con le variabili del simulatore Node.js
+più tag aggiuntivi extra_000.. per arrivare al numero di tag richiesto; i valori
+seguono un random walk aggiornato ogni update_interval secondi.
+
+Uso:
+    python opc_standin.py --units 4 --tags 100 --port 48500
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+from typing import List
+
+import numpy as np
+from asyncua import Server, ua
+
+logger = logging.getLogger(__name__)
+
+# Stesse variabili e valori iniziali del simulatore (opc-simulator/server.js)
+BASE_TAGS = {
+    'fc1065': 127.3, 'li40054': 68.2, 'fc31007': 89.1, 'pi18213': 2.14,
+    'bit_tq': 45.2, 'energy_consumption': 1250.0, 'co2_emissions': 34.5,
+    'hvbgo_flow': 156.8, 'temperature_flash': 420.0, 'system_status': 1.0,
+    'operator_mode': 0.0
+}
+CONSTANT_TAGS = ('system_status', 'operator_mode')
+
+
+def unit_object_name(index: int) -> str:
+    return f"Refinery{index + 1}"
+
+
+async def serve(port: int, units: int, tags: int, update_interval: float = 0.5,
+                ready=None, seed: int = 0) -> None:
+    """Avvia il server e aggiorna i valori fino alla cancellazione"""
+    server = Server()
+    await server.init()
+    server.set_endpoint(f"opc.tcp://127.0.0.1:{port}/refinery")
+    server.set_security_policy([ua.SecurityPolicyType.NoSecurity])
+    namespace = await server.register_namespace("urn:refinery:benchmark")
+
+    tag_names = list(BASE_TAGS) + [f"extra_{index:03d}" for index in range(max(0, tags - len(BASE_TAGS)))]
+    base = np.array([BASE_TAGS.get(name, 100.0) for name in tag_names])
+    walking = np.array([name not in CONSTANT_TAGS for name in tag_names])
+    node_ids: List[List[ua.NodeId]] = []
+    for unit in range(units):
+        refinery = await server.nodes.objects.add_object(namespace, unit_object_name(unit))
+        variables = [await refinery.add_variable(namespace, name, float(value))
+                     for name, value in zip(tag_names, base)]
+        node_ids.append([variable.nodeid for variable in variables])
+
+    rng = np.random.default_rng(seed)
+    values = np.tile(base, (units, 1))
+
+    async with server:
+        logger.info(f"🏭 Stand-in server on port {port}: {units} units x {len(tag_names)} tags")
+        if ready is not None:
+            ready.set()
+        while True:
+            # Random walk di ±0.5% per passo, riportato verso il valore base
+            steps = rng.normal(0, 0.005, values.shape) * base
+            values = np.where(walking, values + steps - 0.05 * (values - base), values)
+            for unit_nodes, unit_values in zip(node_ids, values):
+                for node_id, value in zip(unit_nodes, unit_values):
+                    await server.write_attribute_value(node_id, ua.DataValue(ua.Variant(float(value), ua.VariantType.Double)))
+            await asyncio.sleep(update_interval)
+
+
+def run_server(port: int, units: int, tags: int, update_interval: float, ready, seed: int) -> None:
+    """Entry point del processo server (avviato dal benchmark)"""
+    # Con spawn il modulo principale del benchmark ha già configurato il logging a INFO
+    logging.getLogger().setLevel(logging.WARNING)
+    try:
+        asyncio.run(serve(port, units, tags, update_interval, ready, seed))
+    except KeyboardInterrupt:
+        pass
+
+
+def start_servers(endpoints: int, units: int, tags: int, base_port: int,
+                  update_interval: float = 0.5, timeout: float = 120.0) -> List:
+    """Avvia un processo server per endpoint; le unità sono distribuite in modo uniforme
+
+    Restituisce [(processo, url, [object_name, ...])].
+    """
+    context = multiprocessing.get_context('spawn')
+    servers = []
+    for endpoint in range(endpoints):
+        endpoint_units = units // endpoints + (1 if endpoint < units % endpoints else 0)
+        if not endpoint_units:
+            continue
+        ready = context.Event()
+        port = base_port + endpoint
+        process = context.Process(
+            target=run_server, name=f"opc-standin-{endpoint}", daemon=True,
+            args=(port, endpoint_units, tags, update_interval, ready, endpoint)
+        )
+        process.start()
+        servers.append((process, ready, f"opc.tcp://127.0.0.1:{port}/refinery",
+                        [unit_object_name(index) for index in range(endpoint_units)]))
+
+    for process, ready, url, _ in servers:
+        if not ready.wait(timeout):
+            stop_servers([(process, url, [])])
+            raise RuntimeError(f"OPC-UA stand-in {url} did not start within {timeout}s")
+    return [(process, url, objects) for process, _, url, objects in servers]
+
+
+def stop_servers(servers) -> None:
+    for process, _, _ in servers:
+        process.terminate()
+    for process, _, _ in servers:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OPC-UA stand-in server for benchmarks")
+    parser.add_argument('--port', type=int, default=48500)
+    parser.add_argument('--units', type=int, default=1, help="Oggetti Refinery1..N esposti")
+    parser.add_argument('--tags', type=int, default=len(BASE_TAGS), help="Variabili per unità (minimo 11)")
+    parser.add_argument('--update-interval', type=float, default=0.5, help="Secondi tra due aggiornamenti dei valori")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.getLogger('asyncua').setLevel(logging.WARNING)
+    try:
+        asyncio.run(serve(args.port, args.units, args.tags, args.update_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -14,11 +14,12 @@ CREATE TABLE process_data (
     hvbgo_flow REAL,       -- Flusso ricircolo HVbGO
     temperature_flash REAL, -- Temperatura zona flash
     process_efficiency REAL, -- Efficienza processo %
-    data_source VARCHAR(20) DEFAULT 'opc_ua' -- Fonte dati
+    data_source VARCHAR(20) DEFAULT 'opc_ua', -- Fonte dati
+    unit_id VARCHAR(32) NOT NULL DEFAULT 'unit-1' -- Unità di processo (endpoint OPC-UA)
 );
 
--- Converti in hypertable per performance time-series
-SELECT create_hypertable('process_data', 'timestamp');
+-- Converti in hypertable per performance time-series (chunk giornalieri, vedi configure_storage_policies)
+SELECT create_hypertable('process_data', 'timestamp', chunk_time_interval => INTERVAL '1 day');
 
 -- Tabella decisioni e predizioni AI - VERSIONE CORRETTA CON ID
 CREATE TABLE ai_decisions (
@@ -34,22 +35,33 @@ CREATE TABLE ai_decisions (
     savings_eur_hour REAL,         -- Risparmi €/ora stimati
     anomaly_detected BOOLEAN DEFAULT FALSE,
     decision_applied BOOLEAN DEFAULT FALSE,
-    operator_approved BOOLEAN DEFAULT NULL
+    operator_approved BOOLEAN DEFAULT NULL,
+    unit_id VARCHAR(32) NOT NULL DEFAULT 'unit-1',
+    -- Coda di applicazione: pending -> claimed -> applied | failed (decision_applied resta allineato)
+    state VARCHAR(10) NOT NULL DEFAULT 'pending',
+    claimed_at TIMESTAMPTZ,
+    claimed_by VARCHAR(64),
+    applied_at TIMESTAMPTZ,
+    apply_error TEXT
 );
 
 -- Crea hypertable per ai_decisions
-SELECT create_hypertable('ai_decisions', 'timestamp');
+SELECT create_hypertable('ai_decisions', 'timestamp', chunk_time_interval => INTERVAL '7 days');
 
 -- Indici per performance - MIGLIORATI
 CREATE INDEX idx_process_data_timestamp ON process_data (timestamp DESC);
 CREATE INDEX idx_process_data_bit_tq ON process_data (bit_tq);
 CREATE INDEX idx_process_data_source ON process_data (data_source, timestamp DESC);
+-- Chiave naturale di un campione: rende idempotente il replay dello spool del collector
+CREATE UNIQUE INDEX idx_process_data_unit ON process_data (unit_id, timestamp DESC);
 
 -- Indici specifici per ai_decisions
 CREATE INDEX idx_ai_decisions_timestamp ON ai_decisions (timestamp DESC);
 CREATE INDEX idx_ai_decisions_applied ON ai_decisions (decision_applied, timestamp DESC);
 CREATE INDEX idx_ai_decisions_id ON ai_decisions (id);
 CREATE INDEX idx_ai_decisions_pending ON ai_decisions (decision_applied) WHERE decision_applied = false;
+CREATE INDEX idx_ai_decisions_unit ON ai_decisions (unit_id, timestamp DESC);
+CREATE INDEX idx_ai_decisions_claimable ON ai_decisions (unit_id, timestamp DESC) WHERE state IN ('pending', 'claimed');
 
 -- Tabella anomalie rilevate
 CREATE TABLE anomalies (
@@ -61,15 +73,134 @@ CREATE TABLE anomalies (
     normal_range_max REAL,
     actual_value REAL,
     deviation_percentage REAL,
-    auto_resolved BOOLEAN DEFAULT FALSE
+    auto_resolved BOOLEAN DEFAULT FALSE,
+    unit_id VARCHAR(32) NOT NULL DEFAULT 'unit-1'
 );
 
-SELECT create_hypertable('anomalies', 'timestamp');
+SELECT create_hypertable('anomalies', 'timestamp', chunk_time_interval => INTERVAL '1 day');
+
+-- Ultimo valore per unità: aggiornato da ingest_process_batch(), letture "current" O(1)
+-- senza toccare l'ultimo chunk di process_data (API, stream live, pannelli Grafana)
+CREATE TABLE process_latest (
+    unit_id VARCHAR(32) PRIMARY KEY,
+    timestamp TIMESTAMPTZ NOT NULL,   -- Istante del campione
+    fc1065 REAL,
+    li40054 REAL,
+    fc31007 REAL,
+    pi18213 REAL,
+    bit_tq REAL,
+    energy_consumption REAL,
+    co2_emissions REAL,
+    hvbgo_flow REAL,
+    temperature_flash REAL,
+    process_efficiency REAL,
+    data_source VARCHAR(20),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW() -- Istante dell'upsert
+);
+
+-- Continuous aggregates (1 minuto / 1 ora) per dashboard Grafana e viste di confronto
+-- Le medie per modalità di controllo usano FILTER: una riga per unità e bucket
+CREATE MATERIALIZED VIEW process_data_1m
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT 
+    time_bucket('1 minute', timestamp) AS bucket,
+    unit_id,
+    AVG(bit_tq) AS avg_bit_tq,
+    MIN(bit_tq) AS min_bit_tq,
+    MAX(bit_tq) AS max_bit_tq,
+    AVG(energy_consumption) AS avg_energy,
+    AVG(co2_emissions) AS avg_co2,
+    AVG(process_efficiency) AS avg_efficiency,
+    AVG(hvbgo_flow) AS avg_hvbgo_flow,
+    AVG(fc1065) AS avg_fc1065,
+    AVG(li40054) AS avg_li40054,
+    AVG(fc31007) AS avg_fc31007,
+    AVG(pi18213) AS avg_pi18213,
+    AVG(bit_tq) FILTER (WHERE data_source = 'human_control') AS avg_bit_tq_human,
+    AVG(bit_tq) FILTER (WHERE data_source = 'ai_control') AS avg_bit_tq_ai,
+    COUNT(*) AS datapoints
+FROM process_data
+GROUP BY unit_id, bucket
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW process_data_1h
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT 
+    time_bucket('1 hour', timestamp) AS bucket,
+    unit_id,
+    AVG(bit_tq) AS avg_bit_tq,
+    AVG(energy_consumption) AS avg_energy,
+    AVG(co2_emissions) AS avg_co2,
+    AVG(process_efficiency) AS avg_efficiency,
+    AVG(bit_tq) FILTER (WHERE data_source = 'human_control') AS avg_bit_tq_human,
+    AVG(energy_consumption) FILTER (WHERE data_source = 'human_control') AS avg_energy_human,
+    AVG(co2_emissions) FILTER (WHERE data_source = 'human_control') AS avg_co2_human,
+    COUNT(*) FILTER (WHERE data_source = 'human_control') AS human_datapoints,
+    AVG(bit_tq) FILTER (WHERE data_source = 'ai_control') AS avg_bit_tq_ai,
+    AVG(energy_consumption) FILTER (WHERE data_source = 'ai_control') AS avg_energy_ai,
+    AVG(co2_emissions) FILTER (WHERE data_source = 'ai_control') AS avg_co2_ai,
+    COUNT(*) FILTER (WHERE data_source = 'ai_control') AS ai_datapoints,
+    COUNT(*) AS datapoints
+FROM process_data
+GROUP BY unit_id, bucket
+WITH NO DATA;
+
+-- Aggregati decisioni AI: somme e conteggi (non medie) per poter ri-aggregare su periodi più lunghi o su più unità
+CREATE MATERIALIZED VIEW ai_decisions_1m
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT 
+    time_bucket('1 minute', timestamp) AS bucket,
+    unit_id,
+    COUNT(*) AS decisions,
+    COUNT(*) FILTER (WHERE decision_applied = true) AS applied_decisions,
+    COUNT(*) FILTER (WHERE decision_applied = false) AS pending_decisions,
+    SUM(savings_eur_hour) AS savings_eur_hour,
+    SUM(savings_eur_hour) FILTER (WHERE decision_applied = true) AS applied_savings_eur_hour,
+    SUM(confidence) AS confidence_sum,
+    COUNT(confidence) AS confidence_count,
+    SUM(predicted_bit_tq) AS predicted_bit_tq_sum,
+    COUNT(predicted_bit_tq) AS predicted_bit_tq_count,
+    MAX(timestamp) AS last_decision_time
+FROM ai_decisions
+GROUP BY unit_id, bucket
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW ai_decisions_1h
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT 
+    time_bucket('1 hour', timestamp) AS bucket,
+    unit_id,
+    COUNT(*) AS decisions,
+    COUNT(*) FILTER (WHERE decision_applied = true) AS applied_decisions,
+    SUM(savings_eur_hour) AS savings_eur_hour,
+    SUM(savings_eur_hour) FILTER (WHERE decision_applied = true) AS applied_savings_eur_hour,
+    SUM(predicted_energy_saving) AS energy_saving_sum,
+    COUNT(predicted_energy_saving) AS energy_saving_count,
+    SUM(predicted_co2_reduction) AS co2_reduction_sum,
+    COUNT(predicted_co2_reduction) AS co2_reduction_count
+FROM ai_decisions
+GROUP BY unit_id, bucket
+WITH NO DATA;
+
+-- Refresh automatico: i bucket recenti non materializzati sono calcolati in tempo reale
+SELECT add_continuous_aggregate_policy('process_data_1m',
+    start_offset => INTERVAL '1 day', end_offset => INTERVAL '1 minute',
+    schedule_interval => INTERVAL '1 minute');
+SELECT add_continuous_aggregate_policy('process_data_1h',
+    start_offset => INTERVAL '3 days', end_offset => INTERVAL '1 hour',
+    schedule_interval => INTERVAL '30 minutes');
+SELECT add_continuous_aggregate_policy('ai_decisions_1m',
+    start_offset => INTERVAL '1 day', end_offset => INTERVAL '1 minute',
+    schedule_interval => INTERVAL '1 minute');
+SELECT add_continuous_aggregate_policy('ai_decisions_1h',
+    start_offset => INTERVAL '3 days', end_offset => INTERVAL '1 hour',
+    schedule_interval => INTERVAL '30 minutes');
 
 -- Vista aggregata per dashboard Grafana - MIGLIORATA
 CREATE VIEW dashboard_realtime AS
 SELECT 
     timestamp,
+    unit_id,
     bit_tq,
     energy_consumption,
     co2_emissions,
@@ -93,84 +224,65 @@ FROM process_data
 WHERE timestamp > NOW() - INTERVAL '1 hour'
 ORDER BY timestamp DESC;
 
--- Vista confronto Human vs AI performance - MIGLIORATA
+-- Vista confronto Human vs AI performance - da continuous aggregate orario
 CREATE VIEW human_vs_ai_performance AS
-WITH human_decisions AS (
-    SELECT 
-        DATE_TRUNC('hour', timestamp) as hour,
-        AVG(bit_tq) as avg_bit_tq_human,
-        AVG(energy_consumption) as avg_energy_human,
-        AVG(co2_emissions) as avg_co2_human,
-        COUNT(*) as human_datapoints
-    FROM process_data 
-    WHERE data_source = 'human_control'
-    AND timestamp > NOW() - INTERVAL '24 hours'
-    GROUP BY DATE_TRUNC('hour', timestamp)
-),
-ai_decisions AS (
-    SELECT 
-        DATE_TRUNC('hour', timestamp) as hour,
-        AVG(bit_tq) as avg_bit_tq_ai,
-        AVG(energy_consumption) as avg_energy_ai,
-        AVG(co2_emissions) as avg_co2_ai,
-        COUNT(*) as ai_datapoints
-    FROM process_data 
-    WHERE data_source = 'ai_control'
-    AND timestamp > NOW() - INTERVAL '24 hours'
-    GROUP BY DATE_TRUNC('hour', timestamp)
-)
 SELECT 
-    COALESCE(h.hour, a.hour) as hour,
-    h.avg_bit_tq_human,
-    a.avg_bit_tq_ai,
-    h.avg_energy_human,
-    a.avg_energy_ai,
-    h.avg_co2_human,
-    a.avg_co2_ai,
+    bucket as hour,
+    unit_id,
+    avg_bit_tq_human,
+    avg_bit_tq_ai,
+    avg_energy_human,
+    avg_energy_ai,
+    avg_co2_human,
+    avg_co2_ai,
     CASE 
-        WHEN a.avg_bit_tq_ai > h.avg_bit_tq_human THEN 'AI_BETTER'
-        WHEN h.avg_bit_tq_human > a.avg_bit_tq_ai THEN 'HUMAN_BETTER'
+        WHEN avg_bit_tq_ai > avg_bit_tq_human THEN 'AI_BETTER'
+        WHEN avg_bit_tq_human > avg_bit_tq_ai THEN 'HUMAN_BETTER'
         ELSE 'TIE'
     END as performance_winner,
     CASE 
-        WHEN a.avg_energy_ai < h.avg_energy_human THEN 'AI_MORE_EFFICIENT'
-        WHEN h.avg_energy_human < a.avg_energy_ai THEN 'HUMAN_MORE_EFFICIENT'
+        WHEN avg_energy_ai < avg_energy_human THEN 'AI_MORE_EFFICIENT'
+        WHEN avg_energy_human < avg_energy_ai THEN 'HUMAN_MORE_EFFICIENT'
         ELSE 'TIE'
     END as efficiency_winner
-FROM human_decisions h
-FULL OUTER JOIN ai_decisions a ON h.hour = a.hour
-ORDER BY hour DESC;
+FROM process_data_1h
+WHERE bucket >= DATE_TRUNC('hour', NOW() - INTERVAL '24 hours')
+AND (human_datapoints > 0 OR ai_datapoints > 0)
+ORDER BY hour DESC, unit_id;
 
--- Vista savings calculator - MIGLIORATA
+-- Vista savings calculator - da continuous aggregate orario
 CREATE VIEW savings_calculator AS
 SELECT 
-    DATE_TRUNC('day', timestamp) as day,
+    DATE_TRUNC('day', bucket) as day,
+    unit_id,
     SUM(savings_eur_hour) as daily_savings_eur,
-    AVG(predicted_energy_saving) * 100 as avg_energy_saving_pct,
-    AVG(predicted_co2_reduction) * 100 as avg_co2_reduction_pct,
-    COUNT(*) as ai_decisions_count,
-    COUNT(CASE WHEN decision_applied = true THEN 1 END) as applied_decisions,
+    SUM(energy_saving_sum) / NULLIF(SUM(energy_saving_count), 0) * 100 as avg_energy_saving_pct,
+    SUM(co2_reduction_sum) / NULLIF(SUM(co2_reduction_count), 0) * 100 as avg_co2_reduction_pct,
+    SUM(decisions) as ai_decisions_count,
+    SUM(applied_decisions) as applied_decisions,
     ROUND(
-        COUNT(CASE WHEN decision_applied = true THEN 1 END)::REAL / 
-        NULLIF(COUNT(*), 0) * 100, 2
+        (SUM(applied_decisions)::REAL / 
+        NULLIF(SUM(decisions), 0) * 100)::NUMERIC, 2
     ) as application_rate_pct
-FROM ai_decisions 
-WHERE timestamp > NOW() - INTERVAL '30 days'
-GROUP BY DATE_TRUNC('day', timestamp)
-ORDER BY day DESC;
+FROM ai_decisions_1h 
+WHERE bucket > NOW() - INTERVAL '30 days'
+GROUP BY DATE_TRUNC('day', bucket), unit_id
+ORDER BY day DESC, unit_id;
 
--- Vista AI decision summary per dashboard
+-- Vista AI decision summary per dashboard - da continuous aggregate al minuto, una riga per unità
 CREATE VIEW ai_decision_summary AS
 SELECT 
-    COUNT(*) as total_decisions,
-    COUNT(CASE WHEN decision_applied = true THEN 1 END) as applied_decisions,
-    COUNT(CASE WHEN decision_applied = false THEN 1 END) as pending_decisions,
-    AVG(confidence) as avg_confidence,
-    AVG(predicted_bit_tq) as avg_predicted_bit_tq,
+    unit_id,
+    COALESCE(SUM(decisions), 0) as total_decisions,
+    COALESCE(SUM(applied_decisions), 0) as applied_decisions,
+    COALESCE(SUM(pending_decisions), 0) as pending_decisions,
+    SUM(confidence_sum) / NULLIF(SUM(confidence_count), 0) as avg_confidence,
+    SUM(predicted_bit_tq_sum) / NULLIF(SUM(predicted_bit_tq_count), 0) as avg_predicted_bit_tq,
     SUM(savings_eur_hour) as total_hourly_savings,
-    MAX(timestamp) as last_decision_time
-FROM ai_decisions
-WHERE timestamp > NOW() - INTERVAL '24 hours';
+    MAX(last_decision_time) as last_decision_time
+FROM ai_decisions_1m
+WHERE bucket > NOW() - INTERVAL '24 hours'
+GROUP BY unit_id;
 
 -- Inserimento dati di esempio per test - MIGLIORATI
 INSERT INTO process_data (timestamp, fc1065, li40054, fc31007, pi18213, bit_tq, energy_consumption, co2_emissions, hvbgo_flow, temperature_flash, process_efficiency, data_source) VALUES
@@ -198,82 +310,195 @@ INSERT INTO ai_decisions (
     false
 );
 
--- Trigger per calcolo automatico efficienza - MIGLIORATO
-CREATE OR REPLACE FUNCTION calculate_efficiency()
-RETURNS TRIGGER AS $$
+-- Ingest set-based di process_data (sostituisce i trigger FOR EACH ROW)
+-- Il collector copia ogni batch via COPY nella tabella temporanea di sessione
+-- process_data_incoming e chiama ingest_process_batch() nella stessa transazione:
+-- efficienza e anomalie sono calcolate sull'intero batch con un'unica INSERT ... SELECT
+-- per tabella. Le hypertable non supportano trigger con transition table, da qui lo staging.
+--   CREATE TEMP TABLE process_data_incoming (LIKE process_data INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;
+CREATE OR REPLACE FUNCTION ingest_process_batch()
+RETURNS INTEGER AS $$
+DECLARE
+    inserted INTEGER;
 BEGIN
-    -- Calcola efficienza basata su bit_tq target e consumi energia
-    NEW.process_efficiency := CASE 
-        WHEN NEW.bit_tq >= 50 AND NEW.energy_consumption < 1300 THEN 85 + RANDOM() * 10
-        WHEN NEW.bit_tq >= 45 AND NEW.energy_consumption < 1400 THEN 75 + RANDOM() * 10  
-        WHEN NEW.bit_tq >= 40 THEN 65 + RANDOM() * 10
-        ELSE 50 + RANDOM() * 15
-    END;
+    -- Efficienza basata su bit_tq target e consumi energia, limitata a valori realistici
+    -- (calcolata sullo staging: process_data e process_latest ricevono lo stesso valore)
+    UPDATE process_data_incoming SET
+        process_efficiency = GREATEST(30, LEAST(100, CASE 
+            WHEN bit_tq >= 50 AND energy_consumption < 1300 THEN 85 + RANDOM() * 10
+            WHEN bit_tq >= 45 AND energy_consumption < 1400 THEN 75 + RANDOM() * 10  
+            WHEN bit_tq >= 40 THEN 65 + RANDOM() * 10
+            ELSE 50 + RANDOM() * 15
+        END)),
+        data_source = COALESCE(data_source, 'opc_ua');
+    
+    -- Idempotente su (unit_id, timestamp): campioni già presenti (replay dello spool,
+    -- batch ritentato dopo un timeout) vengono tolti dallo staging, così anomalie,
+    -- process_latest e notifiche riguardano solo le righe nuove
+    WITH new_rows AS (
+        INSERT INTO process_data (
+            timestamp, fc1065, li40054, fc31007, pi18213, bit_tq, energy_consumption,
+            co2_emissions, hvbgo_flow, temperature_flash, process_efficiency, data_source, unit_id
+        )
+        SELECT DISTINCT ON (i.unit_id, i.timestamp)
+            i.timestamp, i.fc1065, i.li40054, i.fc31007, i.pi18213, i.bit_tq, i.energy_consumption,
+            i.co2_emissions, i.hvbgo_flow, i.temperature_flash, i.process_efficiency,
+            i.data_source, i.unit_id
+        FROM process_data_incoming i
+        ON CONFLICT DO NOTHING
+        RETURNING unit_id, timestamp
+    )
+    DELETE FROM process_data_incoming i
+    WHERE NOT EXISTS (
+        SELECT 1 FROM new_rows n WHERE n.unit_id = i.unit_id AND n.timestamp = i.timestamp
+    );
+    
+    SELECT COUNT(*) INTO inserted FROM process_data_incoming;
+    
+    -- Anomalie BIT-TQ ed energia del batch in un solo INSERT
+    INSERT INTO anomalies (
+        timestamp, anomaly_type, severity, parameter_name,
+        normal_range_min, normal_range_max, actual_value,
+        deviation_percentage, unit_id
+    )
+    SELECT i.timestamp, 'BIT_TQ_OUT_OF_RANGE',
+        CASE WHEN i.bit_tq < 30 OR i.bit_tq > 70 THEN 5 ELSE 3 END,
+        'bit_tq', 35, 65, i.bit_tq,
+        ABS(i.bit_tq - 50) / 50 * 100, i.unit_id
+    FROM process_data_incoming i
+    WHERE i.bit_tq < 35 OR i.bit_tq > 65
+    UNION ALL
+    SELECT i.timestamp, 'HIGH_ENERGY_CONSUMPTION', 2,
+        'energy_consumption', 1000, 1400, i.energy_consumption,
+        (i.energy_consumption - 1250) / 1250 * 100, i.unit_id
+    FROM process_data_incoming i
+    WHERE i.energy_consumption > 1500;
+    
+    -- Ultimo campione per unità; un batch in ritardo non sovrascrive un valore più recente
+    INSERT INTO process_latest (
+        unit_id, timestamp, fc1065, li40054, fc31007, pi18213, bit_tq, energy_consumption,
+        co2_emissions, hvbgo_flow, temperature_flash, process_efficiency, data_source
+    )
+    SELECT DISTINCT ON (i.unit_id)
+        i.unit_id, i.timestamp, i.fc1065, i.li40054, i.fc31007, i.pi18213, i.bit_tq,
+        i.energy_consumption, i.co2_emissions, i.hvbgo_flow, i.temperature_flash,
+        i.process_efficiency, i.data_source
+    FROM process_data_incoming i
+    ORDER BY i.unit_id, i.timestamp DESC
+    ON CONFLICT (unit_id) DO UPDATE SET
+        timestamp = EXCLUDED.timestamp,
+        fc1065 = EXCLUDED.fc1065,
+        li40054 = EXCLUDED.li40054,
+        fc31007 = EXCLUDED.fc31007,
+        pi18213 = EXCLUDED.pi18213,
+        bit_tq = EXCLUDED.bit_tq,
+        energy_consumption = EXCLUDED.energy_consumption,
+        co2_emissions = EXCLUDED.co2_emissions,
+        hvbgo_flow = EXCLUDED.hvbgo_flow,
+        temperature_flash = EXCLUDED.temperature_flash,
+        process_efficiency = EXCLUDED.process_efficiency,
+        data_source = EXCLUDED.data_source,
+        updated_at = NOW()
+    WHERE process_latest.timestamp <= EXCLUDED.timestamp;
     
-    -- Assicura che l'efficienza sia realistica
-    NEW.process_efficiency := GREATEST(30, LEAST(100, NEW.process_efficiency));
+    -- Una notifica per unità e batch sul canale process_data (consegnata al commit)
+    PERFORM pg_notify('process_data', json_build_object(
+        'unit_id', i.unit_id,
+        'timestamp', EXTRACT(EPOCH FROM MAX(i.timestamp)),
+        'rows', COUNT(*)
+    )::text)
+    FROM process_data_incoming i
+    GROUP BY i.unit_id;
     
-    RETURN NEW;
+    -- Svuota lo staging anche se il chiamante non chiude subito la transazione
+    DELETE FROM process_data_incoming;
+    
+    RETURN inserted;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Notifiche LISTEN/NOTIFY per nuove decisioni AI e cambi di stato (canale ai_decisions)
+-- Poche righe al minuto: un trigger per riga qui non pesa sull'ingest
+CREATE OR REPLACE FUNCTION notify_ai_decision()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('ai_decisions', json_build_object(
+        'op', TG_OP,
+        'id', NEW.id,
+        'unit_id', NEW.unit_id,
+        'timestamp', EXTRACT(EPOCH FROM NEW.timestamp),
+        'state', NEW.state
+    )::text);
+    RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE TRIGGER trigger_calculate_efficiency
-    BEFORE INSERT ON process_data
+CREATE TRIGGER trigger_notify_ai_decision
+    AFTER INSERT OR UPDATE ON ai_decisions
     FOR EACH ROW
-    EXECUTE FUNCTION calculate_efficiency();
+    EXECUTE FUNCTION notify_ai_decision();
 
--- Trigger per monitoraggio anomalie
-CREATE OR REPLACE FUNCTION detect_anomalies()
-RETURNS TRIGGER AS $$
+-- Compressione nativa: colonnare per segmento, ordinata per timestamp
+ALTER TABLE process_data SET (
+    timescaledb.compress,
+    timescaledb.compress_segmentby = 'unit_id, data_source',
+    timescaledb.compress_orderby = 'timestamp DESC'
+);
+
+-- anomalies non ha data_source: il segmento naturale è unità + parametro monitorato
+ALTER TABLE anomalies SET (
+    timescaledb.compress,
+    timescaledb.compress_segmentby = 'unit_id, parameter_name',
+    timescaledb.compress_orderby = 'timestamp DESC'
+);
+
+-- Policy di storage: chunk interval, compressione e retention (drop di interi chunk)
+-- Richiamabile in qualsiasi momento per cambiare la configurazione, es.:
+--   SELECT configure_storage_policies(process_retention => INTERVAL '90 days');
+CREATE OR REPLACE FUNCTION configure_storage_policies(
+    process_chunk_interval INTERVAL DEFAULT INTERVAL '1 day',
+    decisions_chunk_interval INTERVAL DEFAULT INTERVAL '7 days',
+    anomalies_chunk_interval INTERVAL DEFAULT INTERVAL '1 day',
+    process_compress_after INTERVAL DEFAULT INTERVAL '7 days',
+    anomalies_compress_after INTERVAL DEFAULT INTERVAL '1 day',
+    process_retention INTERVAL DEFAULT INTERVAL '30 days',
+    decisions_retention INTERVAL DEFAULT INTERVAL '90 days',
+    anomalies_retention INTERVAL DEFAULT INTERVAL '7 days'
+)
+RETURNS void AS $$
 BEGIN
-    -- Rileva anomalie BIT-TQ
-    IF NEW.bit_tq < 35 OR NEW.bit_tq > 65 THEN
-        INSERT INTO anomalies (
-            timestamp, anomaly_type, severity, parameter_name,
-            normal_range_min, normal_range_max, actual_value,
-            deviation_percentage
-        ) VALUES (
-            NEW.timestamp, 'BIT_TQ_OUT_OF_RANGE', 
-            CASE WHEN NEW.bit_tq < 30 OR NEW.bit_tq > 70 THEN 5 ELSE 3 END,
-            'bit_tq', 35, 65, NEW.bit_tq,
-            ABS(NEW.bit_tq - 50) / 50 * 100
-        );
-    END IF;
+    -- Il nuovo intervallo vale per i chunk creati da ora in poi
+    PERFORM set_chunk_time_interval('process_data', process_chunk_interval);
+    PERFORM set_chunk_time_interval('ai_decisions', decisions_chunk_interval);
+    PERFORM set_chunk_time_interval('anomalies', anomalies_chunk_interval);
     
-    -- Rileva anomalie energia
-    IF NEW.energy_consumption > 1500 THEN
-        INSERT INTO anomalies (
-            timestamp, anomaly_type, severity, parameter_name,
-            normal_range_min, normal_range_max, actual_value,
-            deviation_percentage
-        ) VALUES (
-            NEW.timestamp, 'HIGH_ENERGY_CONSUMPTION', 2,
-            'energy_consumption', 1000, 1400, NEW.energy_consumption,
-            (NEW.energy_consumption - 1250) / 1250 * 100
-        );
-    END IF;
+    PERFORM remove_compression_policy('process_data', if_exists => true);
+    PERFORM add_compression_policy('process_data', process_compress_after);
+    PERFORM remove_compression_policy('anomalies', if_exists => true);
+    PERFORM add_compression_policy('anomalies', anomalies_compress_after);
     
-    RETURN NEW;
+    PERFORM remove_retention_policy('process_data', if_exists => true);
+    PERFORM add_retention_policy('process_data', process_retention);
+    PERFORM remove_retention_policy('ai_decisions', if_exists => true);
+    PERFORM add_retention_policy('ai_decisions', decisions_retention);
+    PERFORM remove_retention_policy('anomalies', if_exists => true);
+    PERFORM add_retention_policy('anomalies', anomalies_retention);
+    
+    RAISE NOTICE 'Storage policies configured: retention process=%, decisions=%, anomalies=%',
+        process_retention, decisions_retention, anomalies_retention;
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE TRIGGER trigger_detect_anomalies
-    AFTER INSERT ON process_data
-    FOR EACH ROW
-    EXECUTE FUNCTION detect_anomalies();
+SELECT configure_storage_policies();
 
--- Funzione di pulizia dati vecchi (retention policy)
+-- Pulizia manuale immediata (le policy di retention la eseguono già in automatico)
+-- Elimina interi chunk invece di DELETE riga per riga
 CREATE OR REPLACE FUNCTION cleanup_old_data()
 RETURNS void AS $$
 BEGIN
-    -- Mantieni solo 30 giorni di dati processo dettagliati
-    DELETE FROM process_data WHERE timestamp < NOW() - INTERVAL '30 days';
-    
-    -- Mantieni 90 giorni di decisioni AI
-    DELETE FROM ai_decisions WHERE timestamp < NOW() - INTERVAL '90 days';
-    
-    -- Mantieni 7 giorni di anomalie
-    DELETE FROM anomalies WHERE timestamp < NOW() - INTERVAL '7 days';
+    PERFORM drop_chunks('process_data', older_than => INTERVAL '30 days');
+    PERFORM drop_chunks('ai_decisions', older_than => INTERVAL '90 days');
+    PERFORM drop_chunks('anomalies', older_than => INTERVAL '7 days');
     
     RAISE NOTICE 'Cleanup completed at %', NOW();
 END;
@@ -283,13 +508,27 @@ $$ LANGUAGE plpgsql;
 INSERT INTO process_data (timestamp, fc1065, li40054, fc31007, pi18213, bit_tq, energy_consumption, co2_emissions, hvbgo_flow, temperature_flash, process_efficiency, data_source) 
 VALUES (NOW(), 127.3, 68.2, 89.1, 2.14, 45.2, 1250.0, 34.5, 156.8, 420.0, 78.5, 'human_control');
 
+-- Snapshot iniziale dell'ultimo valore per unità dai dati di esempio
+INSERT INTO process_latest (
+    unit_id, timestamp, fc1065, li40054, fc31007, pi18213, bit_tq, energy_consumption,
+    co2_emissions, hvbgo_flow, temperature_flash, process_efficiency, data_source
+)
+SELECT DISTINCT ON (unit_id)
+    unit_id, timestamp, fc1065, li40054, fc31007, pi18213, bit_tq, energy_consumption,
+    co2_emissions, hvbgo_flow, temperature_flash, process_efficiency, data_source
+FROM process_data
+ORDER BY unit_id, timestamp DESC;
+
 -- Log finale
 DO $$
 BEGIN
     RAISE NOTICE '✅ Demo Database initialized successfully!';
-    RAISE NOTICE '📊 Tables created: process_data, ai_decisions, anomalies';
+    RAISE NOTICE '📊 Tables created: process_data, ai_decisions, anomalies, process_latest';
     RAISE NOTICE '🔍 Views created: dashboard_realtime, human_vs_ai_performance, savings_calculator, ai_decision_summary';
-    RAISE NOTICE '⚡ Triggers created: efficiency calculation, anomaly detection';
+    RAISE NOTICE '📈 Continuous aggregates: process_data_1m, process_data_1h, ai_decisions_1m, ai_decisions_1h';
+    RAISE NOTICE '⚡ Set-based ingest: ingest_process_batch() (efficiency calculation, anomaly detection, idempotent on unit_id + timestamp)';
+    RAISE NOTICE '📣 NOTIFY channels: ai_decisions, process_data';
+    RAISE NOTICE '🗜️ Compression and retention policies enabled (see configure_storage_policies)';
     RAISE NOTICE '🧪 Sample data inserted for testing';
     RAISE NOTICE '🚀 System ready for AI-powered refinery optimization!';
 END $$;
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""
+Demo Demo - Replay / backtest delle decisioni AIMock sullo storico process_data
+Legge process_data a blocchi tramite cursore server-side e simula il ciclo
+decisionale con il tempo dei campioni (min_decision_interval incluso). Come nel
+client live, ogni unità ha il proprio AIMock: stato del modello, intervallo tra
+decisioni e risparmi attivi non si mescolano tra unità.
+
+Uso:
+    python replay.py --start 2024-01-01 --end 2024-02-01 --output replay.json
+"""
+
+import argparse
+import asyncio
+import asyncpg
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from main_client_fixed import AIMock
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+REPLAY_COLUMNS = ('timestamp', 'fc1065', 'li40054', 'fc31007', 'pi18213', 'bit_tq', 'data_source')
+
+
+class SimulatedClock:
+    """Orologio guidato dai timestamp dei campioni riprodotti"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class ReplayEngine:
+    """Riproduce lo storico process_data attraverso AIMock in tempo simulato"""
+
+    def __init__(self, db_config: Dict, chunk_size: int = 5000, pending_window: float = 0.0,
+                 seed: Optional[int] = None, decisions_out: Optional[str] = None,
+                 unit_id: Optional[str] = None):
+        self.db_config = db_config
+        self.unit_id = unit_id
+        self.chunk_size = chunk_size
+        self.pending_window = pending_window
+        self.decisions_out = decisions_out
+        self.clock = SimulatedClock()
+        self.ai_models: Dict[str, AIMock] = {}
+        if seed is not None:
+            np.random.seed(seed)
+
+        self.stats = {
+            'rows': 0, 'chunks': 0, 'candidate_rows': 0, 'decisions': 0,
+            'decisions_by_urgency': {}, 'decisions_by_unit': {}, 'predicted_improvement_sum': 0.0,
+            'estimated_savings_eur': 0.0, 'first_timestamp': None, 'last_timestamp': None
+        }
+        # unit_id -> (risparmio orario, inizio validità) dell'ultima decisione dell'unità
+        self._active_decisions: Dict[str, Tuple[float, float]] = {}
+
+    def _ai_model(self, unit_id: str) -> AIMock:
+        model = self.ai_models.get(unit_id)
+        if model is None:
+            model = self.ai_models[unit_id] = AIMock(clock=self.clock)
+        return model
+
+    async def run(self, start: Optional[datetime], end: Optional[datetime]) -> Dict:
+        conn = await asyncpg.connect(
+            host=self.db_config['host'], database=self.db_config['database'],
+            user=self.db_config['user'], password=self.db_config['password'],
+            port=self.db_config['port']
+        )
+        decisions_file = open(self.decisions_out, 'w') if self.decisions_out else None
+        started = time.perf_counter()
+
+        try:
+            # Cursore server-side: in memoria resta un solo blocco alla volta
+            async with conn.transaction(readonly=True):
+                cursor = await conn.cursor(f"""
+                    SELECT unit_id, {', '.join(REPLAY_COLUMNS)}
+                    FROM process_data
+                    WHERE ($1::timestamptz IS NULL OR timestamp >= $1)
+                    AND ($2::timestamptz IS NULL OR timestamp < $2)
+                    AND ($3::varchar IS NULL OR unit_id = $3)
+                    ORDER BY timestamp ASC
+                """, start, end, self.unit_id)
+
+                while True:
+                    rows = await cursor.fetch(self.chunk_size)
+                    if not rows:
+                        break
+                    self._process_chunk(rows, decisions_file)
+        finally:
+            await conn.close()
+            if decisions_file:
+                decisions_file.close()
+
+        # Chiude il periodo di validità dell'ultima decisione di ogni unità
+        if self.stats['last_timestamp'] is not None:
+            for unit_id in list(self._active_decisions):
+                self._accrue_savings(unit_id, self.stats['last_timestamp'].timestamp())
+
+        return self._summary(time.perf_counter() - started)
+
+    def _process_chunk(self, rows, decisions_file) -> None:
+        self.stats['chunks'] += 1
+        self.stats['rows'] += len(rows)
+        if self.stats['first_timestamp'] is None:
+            self.stats['first_timestamp'] = rows[0]['timestamp']
+        self.stats['last_timestamp'] = rows[-1]['timestamp']
+
+        # Pre-filtro vettoriale: stessi criteri di should_generate_decision
+        # (urgenza != NORMAL equivale a BIT-TQ sotto target)
+        bit_tq = np.array([row['bit_tq'] if row['bit_tq'] is not None else 45.0 for row in rows], dtype=float)
+        targets = np.array([self._ai_model(row['unit_id']).bit_tq_target for row in rows], dtype=float)
+        candidates = np.flatnonzero((bit_tq < targets) | (bit_tq < 40) | (bit_tq > 60))
+        self.stats['candidate_rows'] += len(candidates)
+
+        for index in candidates:
+            row = rows[index]
+            sample_time = row['timestamp'].timestamp()
+            ai_model = self._ai_model(row['unit_id'])
+
+            if sample_time - ai_model.last_decision_time < max(ai_model.min_decision_interval, self.pending_window):
+                continue
+
+            self.clock.now = sample_time
+            current_data = {key: row[key] for key in REPLAY_COLUMNS[1:] if row[key] is not None}
+            decision = ai_model.generate_optimization_decision(current_data)
+            if decision:
+                self._record_decision(sample_time, row, decision, decisions_file)
+
+    def _record_decision(self, sample_time: float, row, decision: Dict, decisions_file) -> None:
+        unit_id = row['unit_id']
+        if unit_id in self._active_decisions:
+            self._accrue_savings(unit_id, sample_time)
+        self._active_decisions[unit_id] = (decision['economic_impact']['hourly_savings_eur'], sample_time)
+
+        urgency = decision['analysis']['urgency_level']
+        self.stats['decisions'] += 1
+        self.stats['decisions_by_urgency'][urgency] = self.stats['decisions_by_urgency'].get(urgency, 0) + 1
+        self.stats['decisions_by_unit'][unit_id] = self.stats['decisions_by_unit'].get(unit_id, 0) + 1
+        self.stats['predicted_improvement_sum'] += decision['predictions']['bit_tq'] - decision['analysis']['current_bit_tq']
+
+        if decisions_file:
+            decision['timestamp'] = row['timestamp'].isoformat()
+            decision['unit_id'] = unit_id
+            decisions_file.write(json.dumps(decision, default=float) + '\n')
+
+    def _accrue_savings(self, unit_id: str, until: float) -> None:
+        """I risparmi orari di una decisione valgono fino alla decisione successiva della stessa unità"""
+        hourly_savings, since = self._active_decisions[unit_id]
+        hours = max(0.0, until - since) / 3600
+        self.stats['estimated_savings_eur'] += hourly_savings * hours
+
+    def _summary(self, elapsed: float) -> Dict:
+        stats = self.stats
+        first, last = stats['first_timestamp'], stats['last_timestamp']
+        return {
+            'rows_processed': stats['rows'],
+            'chunks': stats['chunks'],
+            'candidate_rows': stats['candidate_rows'],
+            'decisions': stats['decisions'],
+            'decisions_by_urgency': stats['decisions_by_urgency'],
+            'decisions_by_unit': stats['decisions_by_unit'],
+            'avg_predicted_bit_tq_improvement': round(stats['predicted_improvement_sum'] / stats['decisions'], 3) if stats['decisions'] else 0.0,
+            'estimated_savings_eur': round(stats['estimated_savings_eur'], 2),
+            'period_start': first.isoformat() if first else None,
+            'period_end': last.isoformat() if last else None,
+            'simulated_hours': round((last - first).total_seconds() / 3600, 2) if first and last else 0.0,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(stats['rows'] / elapsed, 1) if elapsed > 0 else 0.0
+        }
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay AIMock decisions over stored process_data")
+    parser.add_argument('--start', help="Inizio periodo (ISO 8601, default: primo campione)")
+    parser.add_argument('--end', help="Fine periodo esclusa (ISO 8601, default: ultimo campione)")
+    parser.add_argument('--unit', help="Unità di processo da riprodurre (default: tutte, in ordine di tempo)")
+    parser.add_argument('--chunk-size', type=int, default=5000, help="Righe per fetch dal cursore server-side")
+    parser.add_argument('--pending-window', type=float, default=0.0,
+                        help="Secondi in cui una decisione resta pendente e blocca le successive (live: 600)")
+    parser.add_argument('--seed', type=int, help="Seed per il rumore del modello (risultati riproducibili)")
+    parser.add_argument('--decisions-out', help="File JSON lines in cui scrivere le singole decisioni")
+    parser.add_argument('--output', help="File JSON per il riepilogo (default: stdout)")
+    args = parser.parse_args()
+
+    db_config = {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'database': os.getenv('DB_NAME', 'refinery_db'),
+        'user': os.getenv('DB_USER', 'postgres'),
+        'password': os.getenv('DB_PASSWORD', 'password'),
+        'port': 5432
+    }
+
+    # Il replay genera molte decisioni: riduce la verbosità del modello
+    logging.getLogger('main_client_fixed').setLevel(logging.WARNING)
+
+    engine = ReplayEngine(db_config, chunk_size=args.chunk_size, pending_window=args.pending_window,
+                          seed=args.seed, decisions_out=args.decisions_out, unit_id=args.unit)
+    logger.info("⏪ Starting process_data replay...")
+    summary = await engine.run(parse_timestamp(args.start), parse_timestamp(args.end))
+
+    output = json.dumps(summary, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        logger.info(f"📄 Replay summary written to {args.output}")
+    else:
+        print(output)
+
+    logger.info(f"✅ Replayed {summary['rows_processed']} rows, {summary['decisions']} decisions, "
+                f"{summary['rows_per_second']:.0f} rows/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
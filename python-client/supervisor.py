@@ -0,0 +1,240 @@
+"""
+Demo Demo - Supervisore multi-processo del collector
+Avvia N processi worker di main_client_fixed, ciascuno proprietario di una
+partizione delle unità OPC_UNITS (rendezvous hashing: ogni unità ha un solo
+proprietario e aggiungere un worker sposta solo le unità che gli spettano).
+I worker terminati vengono riavviati con backoff; ogni worker invia
+periodicamente il proprio throughput al supervisore.
+
+Uso:
+    OPC_UNITS="unit-1=opc.tcp://...,unit-2=..." python supervisor.py --workers 4
+"""
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from typing import Dict, List, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def owner_of(unit_id: str, worker_ids: List[str]) -> str:
+    """Worker proprietario di un'unità: punteggio hash più alto (rendezvous hashing)"""
+    return max(
+        worker_ids,
+        key=lambda worker_id: hashlib.blake2b(f"{unit_id}|{worker_id}".encode(), digest_size=8).digest()
+    )
+
+
+def partition_units(unit_specs: List[Tuple[str, str, str]], worker_ids: List[str]) -> Dict[str, List[Tuple[str, str, str]]]:
+    """Assegna ogni unità a esattamente un worker"""
+    partitions = {worker_id: [] for worker_id in worker_ids}
+    for spec in unit_specs:
+        partitions[owner_of(spec[0], worker_ids)].append(spec)
+    return partitions
+
+
+def run_worker(worker_id: str, unit_specs: List[Tuple[str, str, str]], stats_queue,
+               report_interval: float, startup_delay: float) -> None:
+    """Entry point del processo worker"""
+    logging.getLogger().handlers[0].setFormatter(
+        logging.Formatter(f'%(asctime)s - %(levelname)s - [{worker_id}] %(message)s')
+    )
+    try:
+        asyncio.run(_worker_main(worker_id, unit_specs, stats_queue, report_interval, startup_delay))
+    except KeyboardInterrupt:
+        pass  # Ctrl+C arriva a tutto il gruppo di processi: l'arresto lo gestisce il supervisore
+
+
+async def _worker_main(worker_id: str, unit_specs, stats_queue, report_interval: float,
+                       startup_delay: float) -> None:
+    from main_client_fixed import RefineryDataClient, run_client
+
+    # SIGTERM dal supervisore: cancella il ciclo così close() svuota il buffer
+    main_task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+
+    # Spool su disco separato per worker (un solo processo scrive in ogni directory)
+    spool_root = os.getenv('SPOOL_DIR', 'spool')
+    client = RefineryDataClient(unit_specs, spool_dir=os.path.join(spool_root, worker_id) if spool_root else '')
+    reporter = asyncio.create_task(_report_throughput(worker_id, client, stats_queue, report_interval))
+    try:
+        await run_client(client, startup_delay)
+    except asyncio.CancelledError:
+        logger.info("👋 Worker stopped by supervisor")
+    finally:
+        reporter.cancel()
+
+
+async def _report_throughput(worker_id: str, client, stats_queue, report_interval: float) -> None:
+    """Invia al supervisore contatori e tassi del worker ogni report_interval secondi"""
+    previous = client.counters()
+    previous_time = time.monotonic()
+
+    while True:
+        await asyncio.sleep(report_interval)
+        current = client.counters()
+        now = time.monotonic()
+        elapsed = max(now - previous_time, 1e-9)
+
+        report = dict(current)
+        report['units'] = len(client.units)
+        report['samples_per_s'] = (current['samples'] - previous['samples']) / elapsed
+        report['rows_per_s'] = (current['rows_written'] - previous['rows_written']) / elapsed
+        report['writer_queue'] = client.writer.queue.qsize() if client.writer else 0
+        try:
+            stats_queue.put_nowait((worker_id, report))
+        except queue.Full:
+            pass
+
+        previous, previous_time = current, now
+
+
+class CollectorSupervisor:
+    """Avvia, sorveglia e riavvia i worker del collector"""
+
+    def __init__(self, unit_specs: List[Tuple[str, str, str]], workers: int,
+                 report_interval: float = 30.0, startup_delay: float = 20.0,
+                 restart_backoff_max: float = 60.0):
+        self.worker_ids = [f"collector-{index}" for index in range(workers)]
+        self.partitions = partition_units(unit_specs, self.worker_ids)
+        self.report_interval = report_interval
+        self.startup_delay = startup_delay
+        self.restart_backoff_max = restart_backoff_max
+        self._context = multiprocessing.get_context('spawn')
+        self.stats_queue = self._context.Queue(maxsize=1000)
+        self.processes: Dict[str, multiprocessing.Process] = {}
+        self.restarts = {worker_id: 0 for worker_id in self.worker_ids}
+        self.reports: Dict[str, Dict] = {}
+        self._next_start = {worker_id: 0.0 for worker_id in self.worker_ids}
+        self._started_at = {worker_id: 0.0 for worker_id in self.worker_ids}
+        self._failures = {worker_id: 0 for worker_id in self.worker_ids}  # Uscite ravvicinate consecutive
+        self._stopping = False
+
+    def _start_worker(self, worker_id: str) -> None:
+        process = self._context.Process(
+            target=run_worker, name=worker_id,
+            args=(worker_id, self.partitions[worker_id], self.stats_queue,
+                  self.report_interval, self.startup_delay)
+        )
+        process.start()
+        self.processes[worker_id] = process
+        self._started_at[worker_id] = time.monotonic()
+        units = ', '.join(spec[0] for spec in self.partitions[worker_id])
+        logger.info(f"🚀 Started {worker_id} (pid {process.pid}): {units}")
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        for worker_id in self.worker_ids:
+            if self.partitions[worker_id]:
+                self._start_worker(worker_id)
+            else:
+                logger.info(f"ℹ️ {worker_id} owns no units, not started")
+
+        last_report = time.monotonic()
+        while not self._stopping:
+            self._drain_reports(timeout=1.0)
+            self._check_workers()
+
+            if time.monotonic() - last_report >= self.report_interval:
+                self._log_throughput()
+                last_report = time.monotonic()
+
+        self._shutdown()
+
+    def _request_stop(self, signum, frame) -> None:
+        self._stopping = True
+
+    def _check_workers(self) -> None:
+        """Riavvia i worker terminati, con backoff esponenziale per quelli che cadono in loop"""
+        now = time.monotonic()
+        for worker_id, process in list(self.processes.items()):
+            if process.is_alive() or self._stopping:
+                continue
+
+            if self._next_start[worker_id] == 0.0:
+                # Un worker rimasto attivo a lungo riparte subito; crash in loop rallentano
+                if now - self._started_at[worker_id] > self.restart_backoff_max:
+                    self._failures[worker_id] = 0
+                backoff = min(self.restart_backoff_max, 2 ** min(self._failures[worker_id], 6))
+                self._failures[worker_id] += 1
+                self._next_start[worker_id] = now + backoff
+                logger.warning(f"⚠️ {worker_id} exited (code {process.exitcode}), restarting in {backoff:.0f}s")
+            elif now >= self._next_start[worker_id]:
+                process.join()
+                self.restarts[worker_id] += 1
+                self._next_start[worker_id] = 0.0
+                self._start_worker(worker_id)
+
+    def _drain_reports(self, timeout: float) -> None:
+        try:
+            worker_id, report = self.stats_queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+        self.reports[worker_id] = report
+        while True:
+            try:
+                worker_id, report = self.stats_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.reports[worker_id] = report
+
+    def _log_throughput(self) -> None:
+        total_samples = total_rows = 0.0
+        for worker_id in self.worker_ids:
+            report = self.reports.get(worker_id)
+            if not report:
+                continue
+            total_samples += report['samples_per_s']
+            total_rows += report['rows_per_s']
+            logger.info(f"📈 {worker_id}: {report['units']} units, {report['samples_per_s']:.1f} samples/s, "
+                        f"{report['rows_per_s']:.1f} rows/s, {report['rows_failed']} failed, "
+                        f"queue {report['writer_queue']}, spool {report['spool_pending']}, "
+                        f"restarts {self.restarts[worker_id]}")
+        logger.info(f"📊 Total: {total_samples:.1f} samples/s, {total_rows:.1f} rows/s "
+                    f"across {len(self.processes)} workers")
+
+    def _shutdown(self) -> None:
+        logger.info("🛑 Stopping collector workers...")
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join(timeout=15)
+            if process.is_alive():
+                process.kill()
+        logger.info("👋 Supervisor stopped")
+
+
+def main():
+    from main_client_fixed import parse_unit_specs
+
+    parser = argparse.ArgumentParser(description="Run the collector as N sharded worker processes")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('COLLECTOR_WORKERS', os.cpu_count() or 1)),
+                        help="Numero di processi worker (default: COLLECTOR_WORKERS o numero di core)")
+    parser.add_argument('--report-interval', type=float, default=float(os.getenv('COLLECTOR_REPORT_INTERVAL', '30')),
+                        help="Secondi tra due report di throughput")
+    parser.add_argument('--startup-delay', type=float, default=float(os.getenv('COLLECTOR_STARTUP_DELAY', '20')),
+                        help="Attesa iniziale dei worker per l'avvio del server OPC-UA")
+    args = parser.parse_args()
+
+    opc_url = f"opc.tcp://{os.getenv('OPC_HOST', 'localhost')}:4840/refinery"
+    unit_specs = parse_unit_specs(os.getenv('OPC_UNITS'), opc_url)
+    workers = max(1, min(args.workers, len(unit_specs)))
+
+    logger.info(f"🏭 Supervising {len(unit_specs)} units with {workers} workers")
+    CollectorSupervisor(unit_specs, workers, report_interval=args.report_interval,
+                        startup_delay=args.startup_delay).run()
+
+
+if __name__ == "__main__":
+    main()
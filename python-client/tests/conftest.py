@@ -0,0 +1,12 @@
+"""
+Demo Demo - Configurazione pytest dei test del collector
+I moduli del client sono script nella directory python-client: la aggiunge al path.
+
+Uso (da python-client):
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
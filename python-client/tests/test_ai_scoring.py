@@ -0,0 +1,93 @@
+"""Test dello scoring vettoriale di AIMock (score_batch) contro il calcolo scalare per parametro"""
+
+import numpy as np
+import pytest
+
+from main_client_fixed import AIMock
+
+# Un caso per fascia di urgenza, più valori fuori range (clip) e un valore nullo
+CASES = [
+    {'fc1065': 127.3, 'li40054': 68.2, 'fc31007': 89.1, 'pi18213': 2.14, 'bit_tq': 38.5},
+    {'fc1065': 126.0, 'li40054': 66.0, 'fc31007': 90.5, 'pi18213': 2.11, 'bit_tq': 43.0},
+    {'fc1065': 131.7, 'li40054': 72.4, 'fc31007': 86.2, 'pi18213': 2.25, 'bit_tq': 46.9},
+    {'fc1065': 128.8, 'li40054': 69.9, 'fc31007': 88.0, 'pi18213': 2.18, 'bit_tq': 49.2},
+    {'fc1065': 129.5, 'li40054': 70.1, 'fc31007': 91.3, 'pi18213': 2.20, 'bit_tq': 55.0},
+    {'fc1065': 140.0, 'li40054': 60.0, 'fc31007': 99.0, 'pi18213': 2.50, 'bit_tq': 44.0},
+    {'fc1065': 0.0, 'li40054': 68.2, 'fc31007': 89.1, 'pi18213': 2.14, 'bit_tq': 47.0},
+]
+
+
+class ZeroNoise:
+    """Generatore senza rumore: rende deterministico il confronto"""
+
+    @staticmethod
+    def normal(loc, scale, size=None):
+        return np.zeros(size if size is not None else np.shape(scale)) + loc
+
+
+def scalar_reference(model: AIMock, data):
+    """Calcolo originale per parametro (rami if/elif) di generate_optimization_decision, senza rumore"""
+    urgency = model._calculate_urgency(data['bit_tq'])
+    multiplier = model._get_urgency_multiplier(urgency)
+    rates = {'fc1065': 0.043, 'li40054': 0.048, 'fc31007': -0.027, 'pi18213': 0.037}
+    setpoints = {}
+    for param in model.primary_features:
+        current = data.get(param, model._get_default_value(param))
+        low, high = model.optimal_ranges[param]
+        new_value = current * (1 + rates[param] * model.feature_weights[param] * multiplier)
+        setpoints[param] = round(max(low, min(high, new_value)), 3)
+
+    improvement = 0.0
+    for param, new_value in setpoints.items():
+        current = data.get(param, model._get_default_value(param))
+        if current == 0:
+            current = model._get_default_value(param)
+        change_pct = (new_value - current) / current if current > 0 else 0
+        improvement += change_pct * model.feature_weights[param] * 15
+    improvement = max(0, improvement)
+    monthly_savings = 27781 * max(0.01, improvement / (model.bit_tq_target * 0.05))
+    return {
+        'urgency_level': urgency,
+        'proposed_setpoints': [setpoints[param] for param in model.primary_features],
+        'bit_tq_improvement': improvement,
+        'predicted_bit_tq': data['bit_tq'] + improvement,
+        'energy_saving_pct': min(0.12, improvement * 0.025),
+        'co2_reduction_pct': min(0.15, improvement * 0.03),
+        'hourly_savings_eur': monthly_savings / (30 * 24)
+    }
+
+
+def score(model, cases):
+    features = np.array([[case[param] for param in model.primary_features] for case in cases])
+    return model.score_batch(features, np.array([case['bit_tq'] for case in cases]), rng=ZeroNoise())
+
+
+def test_score_batch_matches_scalar_path():
+    model = AIMock()
+    scores = score(model, CASES)
+    for row, case in enumerate(CASES):
+        expected = scalar_reference(model, case)
+        assert scores['urgency_level'][row] == expected['urgency_level']
+        assert scores['proposed_setpoints'][row].tolist() == expected['proposed_setpoints']
+        for key in ('bit_tq_improvement', 'predicted_bit_tq', 'energy_saving_pct',
+                    'co2_reduction_pct', 'hourly_savings_eur'):
+            assert scores[key][row] == pytest.approx(expected[key], rel=1e-12, abs=1e-12), key
+
+
+def test_score_batch_rows_are_independent():
+    model = AIMock()
+    batch = score(model, CASES)
+    for row, case in enumerate(CASES):
+        single = score(model, [case])
+        np.testing.assert_array_equal(batch['proposed_setpoints'][row], single['proposed_setpoints'][0])
+        assert batch['predicted_bit_tq'][row] == single['predicted_bit_tq'][0]
+
+
+def test_missing_values_use_defaults():
+    model = AIMock()
+    features = np.array([[np.nan, 68.2, np.nan, 2.14]])
+    filled = np.array([[model._get_default_value('fc1065'), 68.2, model._get_default_value('fc31007'), 2.14]])
+    np.testing.assert_array_equal(
+        model.score_batch(features, rng=ZeroNoise())['proposed_setpoints'],
+        model.score_batch(filled, rng=ZeroNoise())['proposed_setpoints']
+    )
@@ -0,0 +1,70 @@
+"""Test del rilevatore di anomalie in streaming (StreamingAnomalyDetector)"""
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from main_client_fixed import StreamingAnomalyDetector
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+BASE = {
+    'fc1065': 127.3, 'li40054': 68.2, 'fc31007': 89.1, 'pi18213': 2.14, 'bit_tq': 45.2,
+    'energy_consumption': 1250.0, 'co2_emissions': 34.5, 'hvbgo_flow': 156.8, 'temperature_flash': 420.0
+}
+
+
+def feed(detector, samples, offset=0):
+    """Campioni con rumore dello 0.2%: restituisce le righe anomalies per campione"""
+    rng = np.random.default_rng(7 + offset)
+    results = []
+    for index in range(samples):
+        data = {tag: value * (1 + rng.normal(0, 0.002)) for tag, value in BASE.items()}
+        results.append(detector.update(START + timedelta(seconds=offset + index), data))
+    return results
+
+
+def test_steady_signal_raises_no_anomalies():
+    detector = StreamingAnomalyDetector()
+    assert not any(feed(detector, 300))
+    assert detector.anomaly_count == 0
+
+
+def test_step_change_is_flagged():
+    detector = StreamingAnomalyDetector()
+    feed(detector, 100)
+
+    data = dict(BASE, bit_tq=BASE['bit_tq'] * 1.2)
+    rows = detector.update(START + timedelta(seconds=100), data)
+
+    flagged = {(row[1], row[3]) for row in rows}
+    assert ('STATISTICAL_DEVIATION', 'bit_tq') in flagged
+    assert ('RATE_OF_CHANGE_SPIKE', 'bit_tq') in flagged
+    assert all(row[3] == 'bit_tq' for row in rows)
+    deviation = next(row for row in rows if row[1] == 'STATISTICAL_DEVIATION')
+    assert deviation[6] == data['bit_tq'] and deviation[6] > deviation[5]
+
+
+def test_warmup_suppresses_detection():
+    detector = StreamingAnomalyDetector(warmup=30)
+    feed(detector, 10)
+    assert detector.update(START, dict(BASE, bit_tq=BASE['bit_tq'] * 1.5)) == []
+
+
+def test_ewma_state_tracks_the_signal():
+    detector = StreamingAnomalyDetector(alpha=0.05)
+    feed(detector, 200)
+    index = StreamingAnomalyDetector.TAGS.index('bit_tq')
+    assert abs(detector.mean[index] - BASE['bit_tq']) < BASE['bit_tq'] * 0.002
+    assert 0 < np.sqrt(detector.var[index]) < BASE['bit_tq'] * 0.004
+
+
+def test_missing_tag_keeps_its_state():
+    detector = StreamingAnomalyDetector()
+    feed(detector, 50)
+    index = StreamingAnomalyDetector.TAGS.index('hvbgo_flow')
+    mean, var, count = detector.mean[index], detector.var[index], detector.count[index]
+
+    data = dict(BASE)
+    del data['hvbgo_flow']
+    detector.update(START, data)
+    assert (detector.mean[index], detector.var[index], detector.count[index]) == (mean, var, count)
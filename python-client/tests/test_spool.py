@@ -0,0 +1,117 @@
+"""Test dello spool su disco di process_data (DiskSpool) e del fallback di ProcessDataWriter"""
+
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+
+from main_client_fixed import DiskSpool, ProcessDataWriter
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_rows(count, unit_id='unit-1'):
+    """Righe nel formato di ProcessDataWriter.COLUMNS"""
+    return [
+        (START + timedelta(seconds=index, microseconds=123), 127.3 + index, 68.2, 89.1, 2.14,
+         45.0 + index / 10, 1250.0, 34.5, None if index % 3 else 156.8, 420.0, 78.5,
+         'ai_control', unit_id)
+        for index in range(count)
+    ]
+
+
+def drain(spool, batch_size=100):
+    rows = []
+    while spool.pending:
+        rows.extend(spool.read_batch(batch_size))
+        spool.commit()
+    return rows
+
+
+def test_round_trip_across_segments(tmp_path):
+    segment_bytes = DiskSpool.HEADER.size + 4 * DiskSpool.RECORD.size
+    spool = DiskSpool(str(tmp_path), segment_bytes=segment_bytes)
+    rows = make_rows(10)
+    spool.append(rows[:6])
+    spool.append(rows[6:])
+
+    assert spool.pending == 10
+    assert len(spool.segments) == 3
+    assert drain(spool, batch_size=3) == rows
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.seg')]
+
+
+def test_replay_after_restart_skips_corrupt_record(tmp_path):
+    spool = DiskSpool(str(tmp_path))
+    rows = make_rows(5)
+    spool.append(rows)
+    spool.close()
+
+    # Un byte alterato nel terzo record: il CRC non corrisponde più
+    path = spool.segments[0][1]
+    offset = DiskSpool.HEADER.size + 2 * DiskSpool.RECORD.size + 10
+    with open(path, 'r+b') as file:
+        file.seek(offset)
+        byte = file.read(1)
+        file.seek(offset)
+        file.write(bytes([byte[0] ^ 0xFF]))
+
+    replay = DiskSpool(str(tmp_path))
+    assert replay.pending == 5
+    assert drain(replay) == rows[:2] + rows[3:]
+    assert replay.records_corrupt == 1
+
+
+def test_restart_truncates_incomplete_record(tmp_path):
+    spool = DiskSpool(str(tmp_path))
+    rows = make_rows(3)
+    spool.append(rows)
+    spool.close()
+    with open(spool.segments[0][1], 'ab') as file:
+        file.write(b'\x01' * (DiskSpool.RECORD.size // 2))  # Crash a metà scrittura
+
+    replay = DiskSpool(str(tmp_path))
+    assert replay.pending == 3
+    assert drain(replay) == rows
+
+
+def test_size_cap_drops_oldest_segments(tmp_path):
+    segment_bytes = DiskSpool.HEADER.size + 4 * DiskSpool.RECORD.size
+    spool = DiskSpool(str(tmp_path), segment_bytes=segment_bytes, max_bytes=2 * segment_bytes)
+    rows = make_rows(12)
+    spool.append(rows)
+
+    assert spool.size_bytes <= 2 * segment_bytes
+    assert spool.records_dropped == 4
+    assert drain(spool) == rows[4:]
+
+
+def test_writer_spools_failed_flush_and_replays_it(tmp_path):
+    """Batch non scritto (DB giù) nello spool, poi reinviato dal drain quando il DB risponde"""
+    written = []
+
+    async def failing_write(rows):
+        raise ConnectionError("database down")
+
+    async def working_write(rows):
+        written.extend(rows)
+
+    async def scenario():
+        writer = ProcessDataWriter(db=None, flush_interval=0.01, spool=DiskSpool(str(tmp_path)))
+        rows = make_rows(7)
+        writer._write = failing_write
+        await writer._flush(rows)
+        assert writer.rows_spooled == 7 and writer.spool.pending == 7
+
+        writer._write = working_write
+        drain = asyncio.create_task(writer._drain())
+        try:
+            for _ in range(100):
+                if not writer.spool.pending:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            drain.cancel()
+        assert written == rows
+        assert writer.rows_replayed == 7
+
+    asyncio.run(scenario())
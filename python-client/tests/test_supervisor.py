@@ -0,0 +1,41 @@
+"""Test della partizione delle unità tra i worker (rendezvous hashing)"""
+
+from supervisor import owner_of, partition_units
+
+UNITS = [(f"unit-{index}", f"opc.tcp://opc-{index % 4}:4840/refinery", f"Refinery{index}") for index in range(1, 201)]
+
+
+def workers(count):
+    return [f"collector-{index}" for index in range(count)]
+
+
+def owners(worker_ids):
+    return {spec[0]: worker_id for worker_id, specs in partition_units(UNITS, worker_ids).items() for spec in specs}
+
+
+def test_every_unit_has_exactly_one_owner():
+    partitions = partition_units(UNITS, workers(4))
+    assigned = [spec for specs in partitions.values() for spec in specs]
+    assert sorted(assigned) == sorted(UNITS)
+    assert set(partitions) == set(workers(4))
+    assert all(specs for specs in partitions.values())
+
+
+def test_partition_is_deterministic_and_order_independent():
+    assert owners(workers(4)) == owners(list(reversed(workers(4))))
+    assert owner_of('unit-7', workers(4)) == owner_of('unit-7', workers(4))
+
+
+def test_adding_a_worker_only_moves_units_to_it():
+    before, after = owners(workers(4)), owners(workers(5))
+    moved = {unit for unit in before if before[unit] != after[unit]}
+    assert moved
+    assert all(after[unit] == 'collector-4' for unit in moved)
+    # Circa 1/5 delle unità: ben lontano dal rimescolamento totale di un hash modulo N
+    assert len(moved) < len(UNITS) * 0.35
+
+
+def test_removing_a_worker_only_moves_its_units():
+    before, after = owners(workers(5)), owners(workers(4))
+    moved = {unit for unit in before if before[unit] != after[unit]}
+    assert moved == {unit for unit, worker_id in before.items() if worker_id == 'collector-4'}